@@ -0,0 +1,743 @@
+import io
+import os
+import gzip
+import zlib
+import hashlib
+import zipfile
+import multiprocessing
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from cache import LRUCache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Definizione dei periodi disponibili
+PERIODS = {
+    "Ultimi 30 GG": 0,
+    "Ultimi 60 GG": 1,
+    "Ultimi 90 GG": 2,
+    "90 precedenti [180-91]": 3,
+    "90 precedenti [270-181]": 4,
+    "90 precedenti [360-271]": 5,
+    "90 precedenti [470-361]": 6,
+    "Ultimi 180": 7,
+    "Ultimi 365 GG": 8
+}
+
+# Colonne per ogni periodo (9 colonne per periodo)
+COLS_PER_PERIOD = 9
+BASE_COLS = ['tag', 'type']
+
+METRIC_COLS = ['LEAD_TOCCATO', 'LEAD_PARLATO', 'CHIAMATA_PRENOTATA',
+               'perc_prenotati_su_toccati', 'SESSIONE_SVOLTA', 'perc_chiuse_su_svolte',
+               'SESSIONE_VENDUTO', 'CHIUSURA_PAY_VALIDA', 'perc_chiuse_pay_su_toccati']
+
+INT_COLS = ['LEAD_TOCCATO', 'LEAD_PARLATO', 'CHIAMATA_PRENOTATA',
+            'SESSIONE_SVOLTA', 'SESSIONE_VENDUTO', 'CHIUSURA_PAY_VALIDA']
+
+# Periodi ordinati cronologicamente (dal più vecchio al più recente)
+ORDERED_PERIODS = [
+    "90 precedenti [470-361]",
+    "90 precedenti [360-271]",
+    "90 precedenti [270-181]",
+    "90 precedenti [180-91]",
+    "Ultimi 90 GG",
+    "Ultimi 60 GG",
+    "Ultimi 30 GG"
+]
+
+# Giorni coperti da ogni periodo, come (primo giorno, ultimo giorno) contati a ritroso da oggi
+PERIOD_DAYS = {
+    "Ultimi 30 GG": (30, 1),
+    "Ultimi 60 GG": (60, 1),
+    "Ultimi 90 GG": (90, 1),
+    "90 precedenti [180-91]": (180, 91),
+    "90 precedenti [270-181]": (270, 181),
+    "90 precedenti [360-271]": (360, 271),
+    "90 precedenti [470-361]": (470, 361),
+    "Ultimi 180": (180, 1),
+    "Ultimi 365 GG": (365, 1)
+}
+
+# I trend si misurano su volumi normalizzati a questa durata (giorni)
+TREND_RATE_DAYS = 30
+
+# Metriche del cubo dei trend (terzo asse)
+TREND_METRICS = ['CHIUSURA_PAY_VALIDA', 'LEAD_TOCCATO', 'conversion_rate']
+
+# Chiavi per cui si precalcola l'ordinamento decrescente di ogni periodo
+RANKING_KEYS = ['CHIUSURA_PAY_VALIDA', 'conversion_rate', 'LEAD_TOCCATO']
+
+# Modalità di parsing dei periodi: 'auto' sceglie in base ai dati
+PARSE_MODES = ('serial', 'thread', 'process', 'auto')
+
+# Sotto questa soglia di righe il costo del pool supera il guadagno
+PARALLEL_MIN_ROWS = 20000
+
+# Firme dei formati compressi accettati
+COMPRESSION_MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+    b'PK\x03\x04': 'zip',
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# sha256 dei byte compressi -> sha256 del contenuto, per non decomprimere due
+# volte lo stesso file caricato di nuovo
+_content_hash_aliases = LRUCache(256)
+
+# Errori dei decompressori per file troncati o corrotti
+_DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error, zipfile.BadZipFile) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+def parse_number(val):
+    """Converte numeri con formato italiano o standard in float"""
+    if pd.isna(val):
+        return 0.0
+    if isinstance(val, (int, float)):
+        return float(val)
+    val_str = str(val).strip()
+    if val_str == '' or val_str == '0':
+        return 0.0
+    # Gestisce sia formato italiano (virgola) che standard (punto)
+    val_str = val_str.replace(',', '.')
+    try:
+        return float(val_str)
+    except:
+        return 0.0
+
+
+def detect_compression(file):
+    """Formato di compressione del file ('gzip', 'zstd', 'zip') o None, dai primi byte"""
+    head = file.read(4)
+    file.seek(0)
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+class _ZstdReader(io.RawIOBase):
+    """Decompressione zstd in streaming che fallisce se l'ultimo frame è incompleto.
+
+    `stream_reader` di zstandard restituisce senza errori i dati di un file
+    troncato; qui a fine input si controlla che l'ultimo frame sia chiuso.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._frame = self._decompressor.decompressobj()
+        self._buffer = memoryview(b'')
+        self._finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._finished:
+            chunk = self._file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                self._finished = True
+                if not self._frame.eof:
+                    raise ValueError("file zstd troncato: l'ultimo frame è incompleto")
+            else:
+                self._buffer = memoryview(self._decompress(chunk))
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def _decompress(self, chunk):
+        out = []
+        while chunk:
+            # File con più frame concatenati: un decompressore per frame
+            if self._frame.eof:
+                self._frame = self._decompressor.decompressobj()
+            out.append(self._frame.decompress(chunk))
+            chunk = self._frame.unused_data
+        return b''.join(out)
+
+
+class _CheckedReader(io.RawIOBase):
+    """Stream decompresso in cui gli errori dei decompressori (file troncati o
+    corrotti) diventano ValueError"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            data = self._stream.read(len(b))
+        except _DECOMPRESSION_ERRORS as e:
+            raise ValueError(f"file compresso non valido ({e})") from e
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+def open_csv_stream(file):
+    """Stream binario del CSV, decompresso al volo se il file è gzip, zstd o zip.
+
+    Un file compresso troncato o corrotto solleva ValueError durante la lettura.
+    """
+    compression = detect_compression(file)
+    if compression is None:
+        return file
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=file, mode='rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("Per i file .zst serve il pacchetto zstandard (pip install zstandard)")
+        stream = _ZstdReader(file)
+    else:
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"file compresso non valido ({e})") from e
+        names = [name for name in archive.namelist() if not name.endswith('/')]
+        csv_names = [name for name in names if name.lower().endswith('.csv')]
+        if len(csv_names) != 1 and len(names) != 1:
+            raise ValueError("L'archivio zip deve contenere un solo file CSV")
+        stream = archive.open(csv_names[0] if len(csv_names) == 1 else names[0])
+    return io.BufferedReader(_CheckedReader(stream), HASH_CHUNK_SIZE)
+
+
+def _sha256_stream(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(file):
+    """sha256 del CSV decompresso: un file compresso ha lo stesso hash del suo CSV.
+
+    Il contenuto compresso viene decompresso e letto a blocchi in streaming,
+    senza parsing: costa una frazione del parsing e permette di riusare un
+    dataset già caricato prima di parsare. Un archivio già visto viene
+    riconosciuto dall'hash dei byte compressi senza decomprimerlo. Il file
+    viene riportato all'inizio, pronto per il parsing; un archivio troncato o
+    corrotto solleva ValueError.
+    """
+    raw_hash = _sha256_stream(file)
+    file.seek(0)
+    if detect_compression(file) is None:
+        return raw_hash
+
+    def _decompressed_hash():
+        try:
+            return _sha256_stream(open_csv_stream(file))
+        finally:
+            file.seek(0)
+
+    return _content_hash_aliases.get_or_build(raw_hash, _decompressed_hash)
+
+
+def convert_block(block):
+    """Converte in float le colonne di un blocco periodo (unità di lavoro dei worker)"""
+    converted = {}
+    for col_name, col in block.items():
+        if pd.api.types.is_numeric_dtype(col.dtype):
+            # Colonna già numerica dal parser C: conversione numpy, rilascia il GIL
+            converted[col_name] = col.to_numpy(dtype=float, na_value=0.0)
+        else:
+            # Formato italiano o misto: parse_number riga per riga, tiene il GIL
+            converted[col_name] = col.map(parse_number).to_numpy(dtype=float)
+    return converted
+
+
+def kernel_releases_gil(blocks):
+    """True se la conversione di tutti i blocchi è puramente numpy"""
+    return all(
+        pd.api.types.is_numeric_dtype(dtype)
+        for block in blocks
+        for dtype in block.dtypes
+    )
+
+
+def resolve_parse_mode(mode, blocks, n_rows):
+    """Risolve la modalità 'auto' in serial, thread o process"""
+    if mode not in PARSE_MODES:
+        raise ValueError(f"Modalità di parsing non valida: {mode!r} (ammesse: {', '.join(PARSE_MODES)})")
+    if mode != 'auto':
+        return mode
+    if n_rows < PARALLEL_MIN_ROWS or (os.cpu_count() or 1) < 2:
+        return 'serial'
+    return 'thread' if kernel_releases_gil(blocks) else 'process'
+
+
+def _get_executor(kind, max_workers):
+    """Restituisce un pool riutilizzabile tra un caricamento e l'altro"""
+    key = (kind, max_workers)
+    with _executors_lock:
+        if key not in _executors:
+            if kind == 'thread':
+                _executors[key] = ThreadPoolExecutor(max_workers=max_workers)
+            else:
+                # spawn: il server Streamlit è multi-thread, fork non è sicuro
+                _executors[key] = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+        return _executors[key]
+
+
+def _discard_executor(kind, max_workers, executor):
+    """Toglie dalla cache un pool rotto, se un'altra sessione non l'ha già sostituito"""
+    with _executors_lock:
+        if _executors.get((kind, max_workers)) is executor:
+            del _executors[(kind, max_workers)]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _convert_parallel(kind, max_workers, blocks):
+    """Converte i blocchi nel pool; se un worker è morto ricrea il pool e riprova una volta"""
+    executor = _get_executor(kind, max_workers)
+    try:
+        return list(executor.map(convert_block, blocks))
+    except BrokenExecutor:
+        _discard_executor(kind, max_workers, executor)
+        return list(_get_executor(kind, max_workers).map(convert_block, blocks))
+
+
+def load_multiperiod_data(file, mode='serial', max_workers=None):
+    """Carica il file CSV con dati multi-periodo (anche compresso gzip, zstd o zip)"""
+    # La prima riga contiene i nomi dei periodi
+    # La seconda riga contiene gli header delle colonne
+    # I dati iniziano dalla terza riga: le saltiamo così il parser C
+    # riconosce già come numeriche le colonne in formato standard.
+    # I file compressi vengono decompressi a blocchi direttamente nel parser
+    data_rows = pd.read_csv(open_csv_stream(file), header=None, skiprows=2, dtype={0: str, 1: str})
+
+    # Estrai il blocco di 9 colonne di ogni periodo
+    blocks = []
+    for period_name, period_idx in PERIODS.items():
+        # Le prime 2 colonne sono tag e type, poi ogni periodo ha 9 colonne
+        col_start = 2 + (period_idx * COLS_PER_PERIOD)
+        block = pd.DataFrame(index=data_rows.index)
+        for i, col_name in enumerate(METRIC_COLS):
+            if col_start + i < len(data_rows.columns):
+                block[col_name] = data_rows.iloc[:, col_start + i]
+            else:
+                block[col_name] = 0
+        blocks.append(block)
+
+    # I periodi sono indipendenti: convertili in parallelo se conviene
+    mode = resolve_parse_mode(mode, blocks, len(data_rows))
+    if mode == 'serial':
+        converted = [convert_block(block) for block in blocks]
+    else:
+        converted = _convert_parallel(mode, max_workers or min(len(blocks), os.cpu_count() or 1), blocks)
+
+    # Rimuovi righe senza tag
+    tags = data_rows.iloc[:, 0]
+    valid = (tags.notna() & (tags != '')).to_numpy()
+
+    # Crea un dizionario per ogni periodo
+    all_periods_data = {}
+    for period_name, columns in zip(PERIODS, converted):
+        period_df = pd.DataFrame({
+            'tag': data_rows.iloc[:, 0],
+            'type': data_rows.iloc[:, 1],
+            **columns
+        })
+        period_df = period_df[valid]
+
+        # Converti colonne numeriche a int dove appropriato
+        for col in INT_COLS:
+            period_df[col] = period_df[col].astype(int)
+
+        all_periods_data[period_name] = period_df
+
+    return all_periods_data
+
+
+def calculate_metrics(df):
+    """Calcola metriche derivate"""
+    df = df.copy()
+
+    # Tasso conversione totale (lead -> vendita)
+    df['conversion_rate'] = np.where(
+        df['LEAD_TOCCATO'] > 0,
+        df['CHIUSURA_PAY_VALIDA'] / df['LEAD_TOCCATO'] * 100,
+        0
+    )
+
+    # Tasso sessione -> vendita
+    df['session_to_sale_rate'] = np.where(
+        df['SESSIONE_SVOLTA'] > 0,
+        df['CHIUSURA_PAY_VALIDA'] / df['SESSIONE_SVOLTA'] * 100,
+        0
+    )
+
+    # Tasso lead -> sessione
+    df['lead_to_session_rate'] = np.where(
+        df['LEAD_TOCCATO'] > 0,
+        df['SESSIONE_SVOLTA'] / df['LEAD_TOCCATO'] * 100,
+        0
+    )
+
+    # Tasso prenotazione
+    df['booking_rate'] = np.where(
+        df['LEAD_TOCCATO'] > 0,
+        df['CHIAMATA_PRENOTATA'] / df['LEAD_TOCCATO'] * 100,
+        0
+    )
+
+    return df
+
+
+def load_dataset(file, mode='serial', max_workers=None):
+    """Carica il CSV e calcola le metriche derivate di ogni periodo"""
+    return {
+        period_name: calculate_metrics(period_df)
+        for period_name, period_df in load_multiperiod_data(file, mode, max_workers).items()
+    }
+
+
+def compare_periods(df_current, df_previous, min_leads=10):
+    """Confronta due periodi e identifica trend"""
+    # Unisci i dataframe
+    merged = df_current[['tag', 'type', 'LEAD_TOCCATO', 'CHIUSURA_PAY_VALIDA', 'conversion_rate']].merge(
+        df_previous[['tag', 'LEAD_TOCCATO', 'CHIUSURA_PAY_VALIDA', 'conversion_rate']],
+        on='tag',
+        suffixes=('_current', '_previous'),
+        how='outer'
+    ).fillna(0)
+
+    # Calcola variazioni
+    merged['lead_change'] = merged['LEAD_TOCCATO_current'] - merged['LEAD_TOCCATO_previous']
+    merged['sales_change'] = merged['CHIUSURA_PAY_VALIDA_current'] - merged['CHIUSURA_PAY_VALIDA_previous']
+    merged['conv_change'] = merged['conversion_rate_current'] - merged['conversion_rate_previous']
+
+    # Filtra per minimo lead
+    merged = merged[
+        (merged['LEAD_TOCCATO_current'] >= min_leads) |
+        (merged['LEAD_TOCCATO_previous'] >= min_leads)
+    ]
+
+    return merged
+
+
+def build_sort_orders(df, keys=RANKING_KEYS):
+    """Posizioni delle righe in ordine decrescente per ogni chiave.
+
+    L'ordinamento è stabile, quindi a parità di valore vale l'ordine originale
+    delle righe come in `nlargest(keep='first')`.
+    """
+    return {key: np.argsort(-df[key].to_numpy(), kind='stable') for key in keys}
+
+
+def top_n(order, mask, n):
+    """Prime n posizioni di `order` ammesse da `mask`, fermandosi appena trovate"""
+    hits = []
+    found = 0
+    start = 0
+    chunk = max(4 * n, 256)
+    while found < n and start < len(order):
+        block = order[start:start + chunk]
+        block = block[mask[block]][:n - found]
+        hits.append(block)
+        found += len(block)
+        start += chunk
+        # Filtri molto selettivi: allarga il blocco invece di fare mille giri
+        chunk *= 2
+    return np.concatenate(hits) if hits else np.empty(0, dtype=np.intp)
+
+
+def filtered_max(values, order, mask):
+    """Massimo dei valori ammessi da `mask`, letto dall'ordine decrescente"""
+    first = top_n(order, mask, 1)
+    return values[first[0]] if len(first) else np.nan
+
+
+def median_from_order(values, order, mask):
+    """Mediana dei valori ammessi da `mask`, letta dall'ordine precalcolato"""
+    selected = order[mask[order]]
+    k = len(selected)
+    if k == 0:
+        return np.nan
+    mid = k // 2
+    if k % 2:
+        return float(values[selected[mid]])
+    return (values[selected[mid - 1]] + values[selected[mid]]) / 2
+
+
+def build_filter_index(df):
+    """Indice dei filtri della sidebar: massimo dei lead e bitmap per type.
+
+    Il filtro sui lead è un confronto diretto sulla colonna: su tutta la
+    colonna costa meno che trasformare in maschera un taglio su un indice
+    ordinato, e non occupa memoria.
+    """
+    leads = df['LEAD_TOCCATO'].to_numpy()
+    # factorize ordinato: i codici seguono l'ordine alfabetico dei type, NaN = -1
+    type_codes, type_names = pd.factorize(df['type'], sort=True)
+    # Pochi type: codici a 1 byte per riga invece di 8
+    type_codes = type_codes.astype(np.int8 if len(type_names) < 127 else np.int32)
+    return {
+        'max_lead': int(leads.max()) if len(leads) else 0,
+        'type_codes': type_codes,
+        'type_names': list(type_names),
+        'type_masks': {name: type_codes == code for code, name in enumerate(type_names)},
+    }
+
+
+def select_rows(df, index, lead_min, selected_type=None):
+    """Maschera delle righe con LEAD_TOCCATO >= lead_min e del type scelto, senza copiare dati"""
+    mask = df['LEAD_TOCCATO'].to_numpy() >= lead_min
+    if selected_type is not None:
+        type_mask = index['type_masks'].get(selected_type)
+        if type_mask is None:
+            mask[:] = False
+        else:
+            mask &= type_mask
+    return mask
+
+
+def aggregate_by_type(df, index, mask, columns):
+    """Somme per type delle righe selezionate, come groupby('type').sum() sulla selezione"""
+    codes = index['type_codes'][mask]
+    valid = codes >= 0
+    codes = codes[valid]
+    n_types = len(index['type_names'])
+    counts = np.bincount(codes, minlength=n_types)
+    sums = {
+        col: np.bincount(codes, weights=df[col].to_numpy()[mask][valid], minlength=n_types)
+        for col in columns
+    }
+    present = counts > 0
+    result = pd.DataFrame({'type': np.asarray(index['type_names'], dtype=object)[present]})
+    for col in columns:
+        result[col] = sums[col][present].astype(df[col].dtype)
+    return result
+
+
+def build_trend_cube(all_data, periods=ORDERED_PERIODS):
+    """Cubo denso periodo × tag × metrica (TREND_METRICS) sui periodi cronologici.
+
+    Le righe con lo stesso tag in un periodo vengono sommate e il conversion
+    rate ricalcolato; un tag assente in un periodo vale 0 e `present` è False.
+    """
+    periods = [period for period in periods if period in all_data]
+    tags = pd.Index(pd.concat([all_data[period]['tag'] for period in periods]).unique())
+    n_tags = len(tags)
+
+    cube = np.zeros((len(periods), n_tags, len(TREND_METRICS)))
+    present = np.zeros((len(periods), n_tags), dtype=bool)
+    for i, period in enumerate(periods):
+        period_df = all_data[period]
+        codes = tags.get_indexer(period_df['tag'])
+        sales = np.bincount(codes, weights=period_df['CHIUSURA_PAY_VALIDA'].to_numpy(), minlength=n_tags)
+        leads = np.bincount(codes, weights=period_df['LEAD_TOCCATO'].to_numpy(), minlength=n_tags)
+        cube[i, :, 0] = sales
+        cube[i, :, 1] = leads
+        np.divide(sales, leads, out=cube[i, :, 2], where=leads > 0)
+        cube[i, :, 2] *= 100
+        present[i, codes] = True
+
+    return {'periods': periods, 'tags': tags, 'cube': cube, 'present': present}
+
+
+def trend_segments(trend):
+    """Serie dei trend su segmenti di giorni disgiunti, a partire dal cubo.
+
+    I periodi "Ultimi 90/60/30 GG" sono annidati: quando un periodo contiene
+    quello successivo (stesso ultimo giorno) gli si sottrae, così "Ultimi 90 GG"
+    diventa il segmento 90-61 e "Ultimi 60 GG" il 60-31. Vendite e lead di ogni
+    segmento sono divisi per la sua durata e riportati a TREND_RATE_DAYS giorni;
+    il conversion rate è ricalcolato sul segmento. Restituisce la serie
+    (periodo, tag, metrica) e la posizione di ogni segmento, cioè il suo giorno
+    centrale in mesi di TREND_RATE_DAYS giorni (negativa, verso il passato).
+    """
+    cube = trend['cube']
+    days = [PERIOD_DAYS[period] for period in trend['periods']]
+    counts = cube[:, :, :2].copy()
+    segments = []
+    for i, (first, last) in enumerate(days):
+        if i + 1 < len(days) and days[i + 1][1] == last and days[i + 1][0] < first:
+            counts[i] -= cube[i + 1, :, :2]
+            last = days[i + 1][0] + 1
+        segments.append((first, last))
+    # Dati incoerenti tra periodi annidati non devono produrre volumi negativi
+    np.maximum(counts, 0, out=counts)
+
+    first, last = np.array(segments, dtype=float).T
+    series = np.zeros(cube.shape)
+    series[:, :, :2] = counts / (first - last + 1)[:, None, None] * TREND_RATE_DAYS
+    np.divide(counts[:, :, 0], counts[:, :, 1], out=series[:, :, 2], where=counts[:, :, 1] > 0)
+    series[:, :, 2] *= 100
+    return series, -(first + last) / 2 / TREND_RATE_DAYS
+
+
+def trend_statistics(trend):
+    """Pendenza, accelerazione e volatilità di ogni tag e metrica, in un'unica passata.
+
+    Si calcolano sulla serie di `trend_segments`, con i segmenti alla loro
+    posizione reale nel tempo: pendenza e accelerazione vengono dai polinomi
+    ortogonali di grado 1 e 2 su quelle posizioni (minimi quadrati), in unità
+    per mese; la volatilità è la deviazione standard delle variazioni al mese
+    tra segmenti consecutivi. Ogni risultato ha forma (tag, metrica).
+    """
+    series, x = trend_segments(trend)
+    n_periods = series.shape[0]
+    empty = np.zeros(series.shape[1:])
+    x = x - x.mean()
+    x_norm = x @ x
+    slope = np.tensordot(x, series, axes=(0, 0)) / x_norm if x_norm > 0 else empty
+
+    # x² reso ortogonale a costante e retta: la spaziatura non è uniforme
+    q = x ** 2 - (x ** 2).mean()
+    if x_norm > 0:
+        q -= (q @ x) / x_norm * x
+    q_norm = q @ q
+    # Derivata seconda della parabola di best fit
+    acceleration = 2 * np.tensordot(q, series, axes=(0, 0)) / q_norm if q_norm > 1e-12 else empty
+
+    # Variazioni divise per la distanza tra i segmenti: un trend lineare non oscilla
+    volatility = (np.diff(series, axis=0) / np.diff(x)[:, None, None]).std(axis=0) if n_periods > 1 else empty
+
+    return {'slope': slope, 'acceleration': acceleration, 'volatility': volatility}
+
+
+def rank_trends(trend, stats, metric, n=10, min_avg_leads=0):
+    """Tag in più rapida crescita e in più rapido calo per la metrica data"""
+    m = TREND_METRICS.index(metric)
+    slope = stats['slope'][:, m]
+    eligible = np.flatnonzero(trend['cube'][:, :, 1].mean(axis=0) >= min_avg_leads)
+
+    def _ranked(positions):
+        return pd.DataFrame({
+            'tag': trend['tags'][positions],
+            'slope': slope[positions],
+            'acceleration': stats['acceleration'][positions, m],
+            'volatility': stats['volatility'][positions, m],
+            'first': trend['cube'][0, positions, m],
+            'last': trend['cube'][-1, positions, m],
+        })
+
+    # argpartition: selezione dei top n in tempo lineare anche con 100k tag
+    k = min(n, len(eligible))
+    if k == 0:
+        return _ranked(eligible), _ranked(eligible)
+    eligible_slope = slope[eligible]
+    rising = eligible[np.argpartition(-eligible_slope, k - 1)[:k]]
+    falling = eligible[np.argpartition(eligible_slope, k - 1)[:k]]
+    rising = rising[np.argsort(-slope[rising], kind='stable')]
+    falling = falling[np.argsort(slope[falling], kind='stable')]
+    return _ranked(rising[slope[rising] > 0]), _ranked(falling[slope[falling] < 0])
+
+
+def normalization_maxima(df, orders, mask):
+    """Massimi di vendite e conversion rate delle righe selezionate, per normalizzare lo score"""
+    return (
+        filtered_max(df['CHIUSURA_PAY_VALIDA'].to_numpy(), orders['CHIUSURA_PAY_VALIDA'], mask),
+        filtered_max(df['conversion_rate'].to_numpy(), orders['conversion_rate'], mask),
+    )
+
+
+def score_period(df, weight_volume, weight_efficiency, max_volume, max_efficiency):
+    """Score composito di tutte le righe del periodo e il suo ordinamento decrescente.
+
+    Volume ed efficienza sono normalizzati 0-100 sui massimi dati (quelli
+    delle righe selezionate, da `normalization_maxima`). Restituisce solo gli
+    array (score, ordinamento), senza copiare il DataFrame: le righe con lo
+    score si estraggono da `df` con `scored_rows`.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volume_score = np.where(
+            max_volume > 0,
+            df['CHIUSURA_PAY_VALIDA'].to_numpy() / max_volume * 100,
+            0
+        )
+        efficiency_score = np.where(
+            max_efficiency > 0,
+            df['conversion_rate'].to_numpy() / max_efficiency * 100,
+            0
+        )
+    composite = volume_score * weight_volume + efficiency_score * weight_efficiency
+    return composite, np.argsort(-composite, kind='stable')
+
+
+def scored_rows(df, composite, positions):
+    """Righe `positions` del periodo con la colonna composite_score (copia solo di quelle)"""
+    return df.iloc[positions].assign(composite_score=composite[positions])
+
+
+def top_performers(df, composite, orders, mask, key='composite_score', n=15):
+    """Prime n righe selezionate per la chiave data; `orders` include 'composite_score'"""
+    return scored_rows(df, composite, top_n(orders[key], mask, n))
+
+
+def _split_rows(df, positions, composite=None):
+    """Righe di ogni categoria estratte con un'unica `iloc` su tutte le posizioni"""
+    all_positions = np.concatenate(list(positions.values()))
+    rows = df.iloc[all_positions] if composite is None else scored_rows(df, composite, all_positions)
+    bounds = np.cumsum([0] + [len(p) for p in positions.values()])
+    return {
+        category: rows.iloc[bounds[i]:bounds[i + 1]]
+        for i, category in enumerate(positions)
+    }
+
+
+def compute_insights(df, composite, orders, mask, n=5):
+    """Insight automatici sulle righe selezionate in una sola passata.
+
+    Restituisce {categoria: DataFrame} per best_balanced, opportunities e
+    to_optimize, nell'ordine delle categorie.
+    """
+    sales = df['CHIUSURA_PAY_VALIDA'].to_numpy()
+    conv = df['conversion_rate'].to_numpy()
+    leads = df['LEAD_TOCCATO'].to_numpy()
+    median_conv = median_from_order(conv, orders['conversion_rate'], mask)
+    median_leads = median_from_order(leads, orders['LEAD_TOCCATO'], mask)
+    high_conv = conv > median_conv
+    low_conv = conv < median_conv
+
+    return _split_rows(df, {
+        # Alto score composito
+        'best_balanced': top_n(orders['composite_score'], mask & (sales >= 3), n),
+        # Alta efficienza, basso volume
+        'opportunities': top_n(
+            orders['conversion_rate'],
+            mask & high_conv & (leads < median_leads) & (sales > 0),
+            n
+        ),
+        # Alto volume, bassa efficienza
+        'to_optimize': top_n(orders['LEAD_TOCCATO'], mask & low_conv & (leads > median_leads), n),
+    }, composite)
+
+
+def period_movers(comparison, n=10):
+    """Tag con la maggiore crescita e il maggiore calo di vendite tra due periodi.
+
+    Restituisce {'growing': DataFrame, 'declining': DataFrame}; crescita e calo
+    ordinano insiemi disgiunti, quindi ogni riga viene ordinata una sola volta.
+    """
+    change = comparison['sales_change'].to_numpy()
+    # Come nlargest/nsmallest: n non positivo non seleziona righe
+    n = max(n, 0)
+    up = np.flatnonzero(change > 0)
+    down = np.flatnonzero(change < 0)
+    # Ordinamenti stabili: a parità di variazione resta l'ordine del confronto
+    return _split_rows(comparison, {
+        'growing': up[np.argsort(-change[up], kind='stable')[:n]],
+        'declining': down[np.argsort(change[down], kind='stable')[:n]],
+    })
@@ -1,9 +1,35 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import os
+import uuid
+
+from analysis import (
+    PERIODS, load_dataset, content_hash, compare_periods,
+    build_sort_orders, build_filter_index, select_rows, aggregate_by_type,
+    normalization_maxima, score_period, scored_rows, top_performers, compute_insights, period_movers,
+    build_trend_cube, trend_statistics, rank_trends
+)
+from session_store import get_store
+from charts import (
+    FUNNEL_COLS, cached_figure, figure_cache_stats, scatter_figure, funnel_figure,
+    trend_line_figure, comparison_figure
+)
+
+
+def tag_list_markdown(tags, details):
+    """Lista di tag con una riga di dettaglio in un unico blocco markdown.
+
+    Un solo elemento per lista: i messaggi al frontend non crescono con N.
+    """
+    if len(tags) == 0:
+        return ""
+    tags = pd.Series(tags, dtype=str).reset_index(drop=True)
+    short = tags.str.slice(0, 35) + np.where(tags.str.len() > 35, '...', '')
+    entries = '**' + short + '**  \n' + pd.Series(details, dtype=str).reset_index(drop=True)
+    return '\n\n---\n\n'.join(entries) + '\n\n---'
+
 
 st.set_page_config(
     page_title="Analisi Performance Tag",
@@ -14,192 +40,46 @@ st.set_page_config(
 st.title("📊 Analisi Performance Tag - Vendite")
 st.markdown("Carica il file CSV per analizzare quali tag performano meglio")
 
-# Definizione dei periodi disponibili
-PERIODS = {
-    "Ultimi 30 GG": 0,
-    "Ultimi 60 GG": 1,
-    "Ultimi 90 GG": 2,
-    "90 precedenti [180-91]": 3,
-    "90 precedenti [270-181]": 4,
-    "90 precedenti [360-271]": 5,
-    "90 precedenti [470-361]": 6,
-    "Ultimi 180": 7,
-    "Ultimi 365 GG": 8
-}
-
-# Colonne per ogni periodo (9 colonne per periodo)
-COLS_PER_PERIOD = 9
-BASE_COLS = ['tag', 'type']
-
-
-def parse_number(val):
-    """Converte numeri con formato italiano o standard in float"""
-    if pd.isna(val):
-        return 0.0
-    if isinstance(val, (int, float)):
-        return float(val)
-    val_str = str(val).strip()
-    if val_str == '' or val_str == '0':
-        return 0.0
-    # Gestisce sia formato italiano (virgola) che standard (punto)
-    val_str = val_str.replace(',', '.')
-    try:
-        return float(val_str)
-    except:
-        return 0.0
-
-
-def load_multiperiod_data(file):
-    """Carica il file CSV con dati multi-periodo"""
-    # Leggi tutto il file
-    df_raw = pd.read_csv(file, header=None)
-
-    # La prima riga contiene i nomi dei periodi
-    # La seconda riga contiene gli header delle colonne
-    # I dati iniziano dalla terza riga
-
-    # Estrai i dati (dalla riga 3 in poi, indice 2)
-    data_rows = df_raw.iloc[2:].reset_index(drop=True)
-
-    # Crea un dizionario per ogni periodo
-    all_periods_data = {}
-
-    for period_name, period_idx in PERIODS.items():
-        # Calcola l'offset delle colonne per questo periodo
-        # Le prime 2 colonne sono tag e type
-        # Poi ogni periodo ha 9 colonne
-        if period_idx == 0:
-            col_start = 2  # Dopo tag e type
-        else:
-            col_start = 2 + (period_idx * COLS_PER_PERIOD)
-
-        col_end = col_start + COLS_PER_PERIOD
-
-        # Estrai le colonne per questo periodo
-        period_df = pd.DataFrame()
-        period_df['tag'] = data_rows.iloc[:, 0]
-        period_df['type'] = data_rows.iloc[:, 1]
-
-        # Mappa le colonne
-        col_names = ['LEAD_TOCCATO', 'LEAD_PARLATO', 'CHIAMATA_PRENOTATA',
-                     'perc_prenotati_su_toccati', 'SESSIONE_SVOLTA', 'perc_chiuse_su_svolte',
-                     'SESSIONE_VENDUTO', 'CHIUSURA_PAY_VALIDA', 'perc_chiuse_pay_su_toccati']
-
-        for i, col_name in enumerate(col_names):
-            if col_start + i < len(data_rows.columns):
-                period_df[col_name] = data_rows.iloc[:, col_start + i].apply(parse_number)
-            else:
-                period_df[col_name] = 0
-
-        # Rimuovi righe senza tag
-        period_df = period_df[period_df['tag'].notna() & (period_df['tag'] != '')]
-
-        # Converti colonne numeriche a int dove appropriato
-        int_cols = ['LEAD_TOCCATO', 'LEAD_PARLATO', 'CHIAMATA_PRENOTATA',
-                    'SESSIONE_SVOLTA', 'SESSIONE_VENDUTO', 'CHIUSURA_PAY_VALIDA']
-        for col in int_cols:
-            period_df[col] = period_df[col].astype(int)
-
-        all_periods_data[period_name] = period_df
-
-    return all_periods_data
-
-
-def calculate_metrics(df):
-    """Calcola metriche derivate"""
-    df = df.copy()
-
-    # Tasso conversione totale (lead -> vendita)
-    df['conversion_rate'] = np.where(
-        df['LEAD_TOCCATO'] > 0,
-        df['CHIUSURA_PAY_VALIDA'] / df['LEAD_TOCCATO'] * 100,
-        0
-    )
-
-    # Tasso sessione -> vendita
-    df['session_to_sale_rate'] = np.where(
-        df['SESSIONE_SVOLTA'] > 0,
-        df['CHIUSURA_PAY_VALIDA'] / df['SESSIONE_SVOLTA'] * 100,
-        0
-    )
-
-    # Tasso lead -> sessione
-    df['lead_to_session_rate'] = np.where(
-        df['LEAD_TOCCATO'] > 0,
-        df['SESSIONE_SVOLTA'] / df['LEAD_TOCCATO'] * 100,
-        0
-    )
-
-    # Tasso prenotazione
-    df['booking_rate'] = np.where(
-        df['LEAD_TOCCATO'] > 0,
-        df['CHIAMATA_PRENOTATA'] / df['LEAD_TOCCATO'] * 100,
-        0
-    )
-
-    return df
-
-
-def calculate_composite_score(df, weight_volume=0.5, weight_efficiency=0.5):
-    """Calcola uno score composito che bilancia volume ed efficienza."""
-    df = df.copy()
-
-    max_volume = df['CHIUSURA_PAY_VALIDA'].max()
-    df['volume_score'] = np.where(
-        max_volume > 0,
-        df['CHIUSURA_PAY_VALIDA'] / max_volume * 100,
-        0
-    )
-
-    max_efficiency = df['conversion_rate'].max()
-    df['efficiency_score'] = np.where(
-        max_efficiency > 0,
-        df['conversion_rate'] / max_efficiency * 100,
-        0
-    )
-
-    df['composite_score'] = (
-        df['volume_score'] * weight_volume +
-        df['efficiency_score'] * weight_efficiency
-    )
-
-    return df
-
-
-def compare_periods(df_current, df_previous, min_leads=10):
-    """Confronta due periodi e identifica trend"""
-    # Unisci i dataframe
-    merged = df_current[['tag', 'type', 'LEAD_TOCCATO', 'CHIUSURA_PAY_VALIDA', 'conversion_rate']].merge(
-        df_previous[['tag', 'LEAD_TOCCATO', 'CHIUSURA_PAY_VALIDA', 'conversion_rate']],
-        on='tag',
-        suffixes=('_current', '_previous'),
-        how='outer'
-    ).fillna(0)
-
-    # Calcola variazioni
-    merged['lead_change'] = merged['LEAD_TOCCATO_current'] - merged['LEAD_TOCCATO_previous']
-    merged['sales_change'] = merged['CHIUSURA_PAY_VALIDA_current'] - merged['CHIUSURA_PAY_VALIDA_previous']
-    merged['conv_change'] = merged['conversion_rate_current'] - merged['conversion_rate_previous']
-
-    # Filtra per minimo lead
-    merged = merged[
-        (merged['LEAD_TOCCATO_current'] >= min_leads) |
-        (merged['LEAD_TOCCATO_previous'] >= min_leads)
-    ]
-
-    return merged
+# Modalità di parsing dei periodi (serial, thread, process, auto)
+PARSE_MODE = os.environ.get("ANALISI_PARSE_MODE", "auto")
 
+# Identificativo stabile della sessione, usato per il budget di memoria
+if 'session_key' not in st.session_state:
+    st.session_state['session_key'] = uuid.uuid4().hex
 
 # Sidebar per upload e filtri
 with st.sidebar:
     st.header("⚙️ Configurazione")
-    uploaded_file = st.file_uploader("Carica il file CSV", type=['csv'])
+    uploaded_file = st.file_uploader(
+        "Carica il file CSV",
+        type=['csv', 'gz', 'zst', 'zip'],
+        help="Accetta anche CSV compressi con gzip, zstd o zip"
+    )
     st.markdown("---")
 
 
 if uploaded_file is not None:
-    # Carica dati multi-periodo
-    all_data = load_multiperiod_data(uploaded_file)
+    # Carica dati multi-periodo (riusa quelli della sessione se il file non cambia)
+    store = get_store()
+    session_key = st.session_state['session_key']
+    try:
+        # Hash del CSV decompresso: compresso o no, lo stesso file riusa gli stessi dati.
+        # Si calcola una volta per upload, non a ogni rerun
+        cached_hash = st.session_state.get('dataset_hash')
+        if cached_hash is not None and cached_hash[0] == uploaded_file.file_id:
+            dataset_hash = cached_hash[1]
+        else:
+            dataset_hash = content_hash(uploaded_file)
+            st.session_state['dataset_hash'] = (uploaded_file.file_id, dataset_hash)
+        # Parsing solo se la sessione non ha già questo contenuto
+        all_data = store.get(
+            session_key,
+            dataset_hash,
+            lambda: load_dataset(uploaded_file, mode=PARSE_MODE)
+        )
+    except ValueError as e:
+        st.error(f"Impossibile leggere il file: {e}")
+        st.stop()
 
     # Sidebar filtri
     with st.sidebar:
@@ -213,12 +93,12 @@ if uploaded_file is not None:
         st.markdown("---")
         st.subheader("Filtri")
 
-        # Carica dati del periodo selezionato
-        df = all_data[selected_period].copy()
-        df = calculate_metrics(df)
+        # Dati del periodo selezionato (metriche già calcolate al caricamento)
+        df = all_data[selected_period]
+        filter_index = store.derived(session_key, ('filter', selected_period), lambda: build_filter_index(df))
 
         # Range lead
-        max_lead = int(df['LEAD_TOCCATO'].max())
+        max_lead = filter_index['max_lead']
         lead_range = st.slider(
             "Range minimo LEAD_TOCCATO",
             min_value=0,
@@ -228,7 +108,7 @@ if uploaded_file is not None:
         )
 
         # Filtro type
-        types = ['Tutti'] + sorted(df['type'].dropna().unique().tolist())
+        types = ['Tutti'] + filter_index['type_names']
         selected_type = st.selectbox("Filtra per Type", types)
 
         st.markdown("---")
@@ -243,12 +123,42 @@ if uploaded_file is not None:
         weight_efficiency = 1 - weight_volume
         st.info(f"Peso Efficienza: {weight_efficiency:.1f}")
 
-    # Applica filtri
-    df_filtered = df[df['LEAD_TOCCATO'] >= lead_range].copy()
-    if selected_type != 'Tutti':
-        df_filtered = df_filtered[df_filtered['type'] == selected_type]
+        st.markdown("---")
+        with st.expander("💾 Memoria"):
+            mem_stats = store.stats()
+            st.caption(
+                f"Sessione: {store.session_bytes(session_key) / 1024 ** 2:.1f} MB | "
+                f"Residente: {mem_stats['resident_bytes'] / 1024 ** 2:.1f} / "
+                f"{mem_stats['budget_bytes'] / 1024 ** 2:.0f} MB"
+            )
+            st.caption(
+                f"Sessioni: {mem_stats['resident_sessions']} in memoria, {mem_stats['spilled_sessions']} su disco | "
+                f"Spill: {mem_stats['spills']} (errori: {mem_stats['spill_errors']}) | "
+                f"Ricaricamenti: {mem_stats['reloads']}"
+            )
+            fig_stats = figure_cache_stats()
+            st.caption(
+                f"Grafici in cache: {fig_stats['size']} / {fig_stats['maxsize']} "
+                f"({fig_stats['nbytes'] / 1024 ** 2:.1f} / {fig_stats['max_bytes'] / 1024 ** 2:.0f} MB) | "
+                f"Hit: {fig_stats['hits']} | Miss: {fig_stats['misses']}"
+            )
 
-    df_filtered = calculate_composite_score(df_filtered, weight_volume, weight_efficiency)
+    # Ordinamenti decrescenti del periodo, calcolati una volta per sessione
+    orders = store.derived(session_key, ('orders', selected_period), lambda: build_sort_orders(df))
+    # Applica filtri: selezione di righe del periodo, senza copie
+    mask = select_rows(df, filter_index, lead_range, None if selected_type == 'Tutti' else selected_type)
+
+    # Lo score composito (e il suo ordinamento) cambia solo con i pesi o con i
+    # massimi di normalizzazione del sottoinsieme filtrato; in cache restano solo
+    # gli array, le altre colonne si leggono da df
+    max_volume, max_efficiency = normalization_maxima(df, orders, mask)
+    composite, composite_order = store.derived(
+        session_key,
+        ('composite', selected_period),
+        lambda: score_period(df, weight_volume, weight_efficiency, max_volume, max_efficiency),
+        version=(weight_volume, max_volume, max_efficiency)
+    )
+    ranking_orders = {**orders, 'composite_score': composite_order}
 
     # === TAB PRINCIPALE ===
     tab_main, tab_trend, tab_compare = st.tabs(["📊 Analisi Periodo", "📈 Trend Temporali", "🔄 Confronto Periodi"])
@@ -258,16 +168,18 @@ if uploaded_file is not None:
         st.header(f"📈 Panoramica - {selected_period}")
 
         col1, col2, col3, col4, col5 = st.columns(5)
+        total_leads = df['LEAD_TOCCATO'].to_numpy()[mask].sum()
+        total_sales = df['CHIUSURA_PAY_VALIDA'].to_numpy()[mask].sum()
         with col1:
-            st.metric("Tag Analizzati", len(df_filtered))
+            st.metric("Tag Analizzati", int(mask.sum()))
         with col2:
-            st.metric("Lead Totali", f"{df_filtered['LEAD_TOCCATO'].sum():,}")
+            st.metric("Lead Totali", f"{total_leads:,}")
         with col3:
-            st.metric("Sessioni Totali", f"{df_filtered['SESSIONE_SVOLTA'].sum():,}")
+            st.metric("Sessioni Totali", f"{df['SESSIONE_SVOLTA'].to_numpy()[mask].sum():,}")
         with col4:
-            st.metric("Vendite Totali", f"{df_filtered['CHIUSURA_PAY_VALIDA'].sum():,}")
+            st.metric("Vendite Totali", f"{total_sales:,}")
         with col5:
-            avg_conv = df_filtered['CHIUSURA_PAY_VALIDA'].sum() / df_filtered['LEAD_TOCCATO'].sum() * 100 if df_filtered['LEAD_TOCCATO'].sum() > 0 else 0
+            avg_conv = total_sales / total_leads * 100 if total_leads > 0 else 0
             st.metric("Conversion Rate Medio", f"{avg_conv:.2f}%")
 
         # Top performer
@@ -277,7 +189,7 @@ if uploaded_file is not None:
         tab1, tab2, tab3 = st.tabs(["Score Composito", "Per Volume", "Per Efficienza"])
 
         with tab1:
-            top_composite = df_filtered.nlargest(15, 'composite_score')[
+            top_composite = top_performers(df, composite, ranking_orders, mask, 'composite_score', 15)[
                 ['tag', 'type', 'LEAD_TOCCATO', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA',
                  'conversion_rate', 'session_to_sale_rate', 'composite_score']
             ].copy()
@@ -288,7 +200,7 @@ if uploaded_file is not None:
             st.dataframe(top_composite, use_container_width=True, hide_index=True)
 
         with tab2:
-            top_volume = df_filtered.nlargest(15, 'CHIUSURA_PAY_VALIDA')[
+            top_volume = top_performers(df, composite, ranking_orders, mask, 'CHIUSURA_PAY_VALIDA', 15)[
                 ['tag', 'type', 'LEAD_TOCCATO', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA',
                  'conversion_rate', 'session_to_sale_rate']
             ].copy()
@@ -298,7 +210,7 @@ if uploaded_file is not None:
             st.dataframe(top_volume, use_container_width=True, hide_index=True)
 
         with tab3:
-            top_efficiency = df_filtered.nlargest(15, 'conversion_rate')[
+            top_efficiency = top_performers(df, composite, ranking_orders, mask, 'conversion_rate', 15)[
                 ['tag', 'type', 'LEAD_TOCCATO', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA',
                  'conversion_rate', 'session_to_sale_rate']
             ].copy()
@@ -313,98 +225,76 @@ if uploaded_file is not None:
 
         col1, col2 = st.columns(2)
 
+        # Le figure dipendono solo da dataset, periodo e filtri, non dai pesi
+        view_key = (dataset_hash, selected_period, lead_range, selected_type)
+
         with col1:
-            fig_scatter = px.scatter(
-                df_filtered,
-                x='CHIUSURA_PAY_VALIDA',
-                y='conversion_rate',
-                size='LEAD_TOCCATO',
-                color='type',
-                hover_name='tag',
-                title='Volume vs Efficienza',
-                labels={'CHIUSURA_PAY_VALIDA': 'Vendite', 'conversion_rate': 'Conversion Rate (%)'}
+            fig_scatter = cached_figure(
+                ('scatter',) + view_key,
+                lambda: scatter_figure(
+                    df.loc[mask, ['tag', 'type', 'LEAD_TOCCATO', 'CHIUSURA_PAY_VALIDA', 'conversion_rate']]
+                )
             )
-            fig_scatter.update_layout(height=500)
             st.plotly_chart(fig_scatter, use_container_width=True)
 
         with col2:
             # Funnel per type
-            funnel_by_type = df_filtered.groupby('type').agg({
-                'LEAD_TOCCATO': 'sum',
-                'CHIAMATA_PRENOTATA': 'sum',
-                'SESSIONE_SVOLTA': 'sum',
-                'CHIUSURA_PAY_VALIDA': 'sum'
-            }).reset_index()
-
-            fig_funnel = go.Figure()
-            for _, row in funnel_by_type.iterrows():
-                fig_funnel.add_trace(go.Bar(
-                    name=row['type'],
-                    x=['Lead', 'Prenotate', 'Sessioni', 'Vendite'],
-                    y=[row['LEAD_TOCCATO'], row['CHIAMATA_PRENOTATA'],
-                       row['SESSIONE_SVOLTA'], row['CHIUSURA_PAY_VALIDA']],
-                ))
-            fig_funnel.update_layout(title='Funnel per Type', barmode='group', height=500)
+            fig_funnel = cached_figure(
+                ('funnel',) + view_key,
+                lambda: funnel_figure(aggregate_by_type(df, filter_index, mask, FUNNEL_COLS))
+            )
             st.plotly_chart(fig_funnel, use_container_width=True)
 
         # Insights automatici
         st.markdown("---")
         st.header("💡 Insights Automatici")
 
-        best_balanced = df_filtered[df_filtered['CHIUSURA_PAY_VALIDA'] >= 3].nlargest(5, 'composite_score')
-        high_eff_low_vol = df_filtered[
-            (df_filtered['conversion_rate'] > df_filtered['conversion_rate'].median()) &
-            (df_filtered['LEAD_TOCCATO'] < df_filtered['LEAD_TOCCATO'].median()) &
-            (df_filtered['CHIUSURA_PAY_VALIDA'] > 0)
-        ].nlargest(5, 'conversion_rate')
-        high_vol_low_eff = df_filtered[
-            (df_filtered['conversion_rate'] < df_filtered['conversion_rate'].median()) &
-            (df_filtered['LEAD_TOCCATO'] > df_filtered['LEAD_TOCCATO'].median())
-        ].nlargest(5, 'LEAD_TOCCATO')
+        insights = compute_insights(df, composite, ranking_orders, mask)
+        # Dettagli di ogni categoria formattati sulle colonne, senza iterrows
+        insight_lists = {
+            category: tag_list_markdown(rows['tag'], (
+                ('Vendite: ' + rows['CHIUSURA_PAY_VALIDA'].astype(int).astype(str))
+                if category == 'best_balanced'
+                else ('Lead: ' + rows['LEAD_TOCCATO'].astype(int).astype(str))
+            ) + ' | Conv: ' + rows['conversion_rate'].map('{:.2f}'.format) + '%')
+            for category, rows in insights.items()
+        }
 
         col1, col2, col3 = st.columns(3)
 
         with col1:
             st.subheader("🌟 Best Balanced")
             st.caption("Alto score composito")
-            for _, row in best_balanced.iterrows():
-                tag_display = f"**{row['tag'][:35]}...**" if len(row['tag']) > 35 else f"**{row['tag']}**"
-                st.write(tag_display)
-                st.write(f"Vendite: {int(row['CHIUSURA_PAY_VALIDA'])} | Conv: {row['conversion_rate']:.2f}%")
-                st.markdown("---")
+            if insight_lists['best_balanced']:
+                st.markdown(insight_lists['best_balanced'])
 
         with col2:
             st.subheader("🚀 Opportunità")
             st.caption("Alta efficienza, basso volume")
-            for _, row in high_eff_low_vol.iterrows():
-                tag_display = f"**{row['tag'][:35]}...**" if len(row['tag']) > 35 else f"**{row['tag']}**"
-                st.write(tag_display)
-                st.write(f"Lead: {int(row['LEAD_TOCCATO'])} | Conv: {row['conversion_rate']:.2f}%")
-                st.markdown("---")
+            if insight_lists['opportunities']:
+                st.markdown(insight_lists['opportunities'])
 
         with col3:
             st.subheader("⚠️ Da Ottimizzare")
             st.caption("Alto volume, bassa efficienza")
-            for _, row in high_vol_low_eff.iterrows():
-                tag_display = f"**{row['tag'][:35]}...**" if len(row['tag']) > 35 else f"**{row['tag']}**"
-                st.write(tag_display)
-                st.write(f"Lead: {int(row['LEAD_TOCCATO'])} | Conv: {row['conversion_rate']:.2f}%")
-                st.markdown("---")
+            if insight_lists['to_optimize']:
+                st.markdown(insight_lists['to_optimize'])
 
         # Tabella completa
         st.markdown("---")
         st.header("🔍 Esplora tutti i Tag")
 
         search = st.text_input("Cerca tag", "")
-        df_display = df_filtered.copy()
+        display_mask = mask
         if search:
-            df_display = df_display[df_display['tag'].str.contains(search, case=False, na=False)]
+            display_mask = mask & df['tag'].str.contains(search, case=False, na=False).to_numpy()
 
-        df_display = df_display[[
+        # Righe già in ordine di score: basta scorrere l'ordinamento precalcolato
+        df_display = scored_rows(df, composite, composite_order[display_mask[composite_order]])[[
             'tag', 'type', 'LEAD_TOCCATO', 'LEAD_PARLATO', 'CHIAMATA_PRENOTATA',
             'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA', 'conversion_rate',
             'session_to_sale_rate', 'composite_score'
-        ]].sort_values('composite_score', ascending=False)
+        ]]
 
         df_display['conversion_rate'] = df_display['conversion_rate'].round(2)
         df_display['session_to_sale_rate'] = df_display['session_to_sale_rate'].round(2)
@@ -426,6 +316,45 @@ if uploaded_file is not None:
         st.header("📈 Trend Temporali")
         st.markdown("Analizza come cambiano le performance nel tempo")
 
+        # Cubo periodo × tag × metrica sui periodi cronologici, costruito una volta
+        trend = store.derived(session_key, 'trend_cube', lambda: build_trend_cube(all_data))
+        trend_stats = store.derived(session_key, 'trend_stats', lambda: trend_statistics(trend))
+
+        # Classifica su tutti i tag
+        st.subheader("🏁 Classifica Trend")
+        st.caption(
+            "Pendenza: variazione media al mese (retta ai minimi quadrati) di vendite ogni 30 giorni "
+            "o del conversion rate, su segmenti di giorni disgiunti | Accelerazione: curvatura del trend | "
+            "Volatilità: deviazione standard delle variazioni al mese tra segmenti"
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            trend_metric = st.selectbox("Metrica", ["Vendite", "Conv Rate"], key="trend_metric")
+        with col2:
+            trend_min_leads = st.slider("Lead medi minimi per periodo", 0, 200, 20, step=10, key="trend_min_leads")
+        with col3:
+            trend_top_n = st.slider("Numero di tag", 5, 50, 10, step=5, key="trend_top_n")
+
+        rising, falling = rank_trends(
+            trend,
+            trend_stats,
+            {"Vendite": 'CHIUSURA_PAY_VALIDA', "Conv Rate": 'conversion_rate'}[trend_metric],
+            trend_top_n,
+            trend_min_leads
+        )
+
+        col1, col2 = st.columns(2)
+        for col, title, ranking in [(col1, "🚀 In più rapida crescita", rising), (col2, "📉 In più rapido calo", falling)]:
+            with col:
+                st.markdown(f"**{title}**")
+                ranking = ranking.round(2)
+                ranking.columns = ['Tag', 'Pendenza', 'Accelerazione', 'Volatilità',
+                                   trend['periods'][0], trend['periods'][-1]]
+                st.dataframe(ranking, use_container_width=True, hide_index=True)
+
+        st.markdown("---")
+        st.subheader("Confronto Tag")
+
         # Seleziona tag da analizzare
         all_tags = sorted(df['tag'].unique().tolist())
         selected_tags = st.multiselect(
@@ -436,60 +365,40 @@ if uploaded_file is not None:
         )
 
         if selected_tags:
-            # Periodi ordinati cronologicamente (dal più vecchio al più recente)
-            ordered_periods = [
-                "90 precedenti [470-361]",
-                "90 precedenti [360-271]",
-                "90 precedenti [270-181]",
-                "90 precedenti [180-91]",
-                "Ultimi 90 GG",
-                "Ultimi 60 GG",
-                "Ultimi 30 GG"
-            ]
-
-            # Costruisci dati per il grafico
+            # Costruisci dati per il grafico leggendo dal cubo
+            cube = trend['cube']
+            tag_positions = trend['tags'].get_indexer(selected_tags)
             trend_data = []
-            for period in ordered_periods:
-                if period in all_data:
-                    period_df = calculate_metrics(all_data[period])
-                    for tag in selected_tags:
-                        tag_data = period_df[period_df['tag'] == tag]
-                        if not tag_data.empty:
-                            trend_data.append({
-                                'Periodo': period,
-                                'Tag': tag[:30] + '...' if len(tag) > 30 else tag,
-                                'Vendite': tag_data['CHIUSURA_PAY_VALIDA'].values[0],
-                                'Lead': tag_data['LEAD_TOCCATO'].values[0],
-                                'Conv Rate': tag_data['conversion_rate'].values[0]
-                            })
+            for i, period in enumerate(trend['periods']):
+                for tag, pos in zip(selected_tags, tag_positions):
+                    if pos >= 0 and trend['present'][i, pos]:
+                        trend_data.append({
+                            'Periodo': period,
+                            'Tag': tag[:30] + '...' if len(tag) > 30 else tag,
+                            'Vendite': int(cube[i, pos, 0]),
+                            'Lead': int(cube[i, pos, 1]),
+                            'Conv Rate': cube[i, pos, 2]
+                        })
 
             if trend_data:
                 trend_df = pd.DataFrame(trend_data)
 
                 col1, col2 = st.columns(2)
 
+                trend_key = (dataset_hash, tuple(selected_tags))
+
                 with col1:
-                    fig_trend_sales = px.line(
-                        trend_df,
-                        x='Periodo',
-                        y='Vendite',
-                        color='Tag',
-                        markers=True,
-                        title='Trend Vendite nel Tempo'
+                    fig_trend_sales = cached_figure(
+                        ('trend_sales',) + trend_key,
+                        lambda: trend_line_figure(trend_df, 'Vendite', 'Trend Vendite nel Tempo')
                     )
-                    fig_trend_sales.update_layout(height=400)
                     st.plotly_chart(fig_trend_sales, use_container_width=True)
 
                 with col2:
-                    fig_trend_conv = px.line(
-                        trend_df,
-                        x='Periodo',
-                        y='Conv Rate',
-                        color='Tag',
-                        markers=True,
-                        title='Trend Conversion Rate nel Tempo'
+                    fig_trend_conv = cached_figure(
+                        ('trend_conv',) + trend_key,
+                        lambda: trend_line_figure(trend_df, 'Conv Rate', 'Trend Conversion Rate nel Tempo')
                     )
-                    fig_trend_conv.update_layout(height=400)
                     st.plotly_chart(fig_trend_conv, use_container_width=True)
 
                 # Tabella riassuntiva
@@ -519,60 +428,45 @@ if uploaded_file is not None:
         min_leads_compare = st.slider("Lead minimo per confronto", 0, 100, 20, key="min_leads_compare")
 
         # Calcola confronto
-        df_curr = calculate_metrics(all_data[period_current])
-        df_prev = calculate_metrics(all_data[period_previous])
+        df_curr = all_data[period_current]
+        df_prev = all_data[period_previous]
 
         comparison = compare_periods(df_curr, df_prev, min_leads_compare)
 
         if not comparison.empty:
+            movers = period_movers(comparison)
+            mover_lists = {
+                category: tag_list_markdown(rows['tag'], (
+                    'Vendite: ' + rows['CHIUSURA_PAY_VALIDA_previous'].astype(int).astype(str)
+                    + ' → ' + rows['CHIUSURA_PAY_VALIDA_current'].astype(int).astype(str)
+                    + ' (' + rows['sales_change'].astype(int).map('{:+d}'.format) + ')'
+                ))
+                for category, rows in movers.items()
+            }
             col1, col2 = st.columns(2)
 
             with col1:
                 st.subheader("📈 In Crescita (Vendite)")
-                growing = comparison[comparison['sales_change'] > 0].nlargest(10, 'sales_change')
-                for _, row in growing.iterrows():
-                    tag_display = row['tag'][:35] + '...' if len(row['tag']) > 35 else row['tag']
-                    change = int(row['sales_change'])
-                    st.write(f"**{tag_display}**")
-                    st.write(f"Vendite: {int(row['CHIUSURA_PAY_VALIDA_previous'])} → {int(row['CHIUSURA_PAY_VALIDA_current'])} (+{change})")
-                    st.markdown("---")
+                if mover_lists['growing']:
+                    st.markdown(mover_lists['growing'])
 
             with col2:
                 st.subheader("📉 In Calo (Vendite)")
-                declining = comparison[comparison['sales_change'] < 0].nsmallest(10, 'sales_change')
-                for _, row in declining.iterrows():
-                    tag_display = row['tag'][:35] + '...' if len(row['tag']) > 35 else row['tag']
-                    change = int(row['sales_change'])
-                    st.write(f"**{tag_display}**")
-                    st.write(f"Vendite: {int(row['CHIUSURA_PAY_VALIDA_previous'])} → {int(row['CHIUSURA_PAY_VALIDA_current'])} ({change})")
-                    st.markdown("---")
+                if mover_lists['declining']:
+                    st.markdown(mover_lists['declining'])
 
             # Grafico confronto
             st.subheader("Grafico Confronto")
 
             # Top 20 per variazione assoluta
-            comparison['abs_change'] = comparison['sales_change'].abs()
-            top_changes = comparison.nlargest(20, 'abs_change').copy()
-            top_changes['tag_short'] = top_changes['tag'].apply(lambda x: x[:25] + '...' if len(x) > 25 else x)
-
-            fig_compare = go.Figure()
-            fig_compare.add_trace(go.Bar(
-                name=period_previous,
-                x=top_changes['tag_short'],
-                y=top_changes['CHIUSURA_PAY_VALIDA_previous'],
-                marker_color='lightblue'
-            ))
-            fig_compare.add_trace(go.Bar(
-                name=period_current,
-                x=top_changes['tag_short'],
-                y=top_changes['CHIUSURA_PAY_VALIDA_current'],
-                marker_color='darkblue'
-            ))
-            fig_compare.update_layout(
-                title='Confronto Vendite tra Periodi (Top 20 variazioni)',
-                barmode='group',
-                height=500,
-                xaxis_tickangle=-45
+            def _comparison_figure():
+                top_changes = comparison.assign(abs_change=comparison['sales_change'].abs()).nlargest(20, 'abs_change')
+                top_changes['tag_short'] = top_changes['tag'].apply(lambda x: x[:25] + '...' if len(x) > 25 else x)
+                return comparison_figure(top_changes, period_previous, period_current)
+
+            fig_compare = cached_figure(
+                ('compare', dataset_hash, period_current, period_previous, min_leads_compare),
+                _comparison_figure
             )
             st.plotly_chart(fig_compare, use_container_width=True)
 
@@ -0,0 +1,93 @@
+"""Benchmark del parsing multi-periodo nelle diverse modalità di esecuzione.
+
+Uso: python benchmark.py [--rows 200000] [--repeat 3] [--decimal ,]
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis import PERIODS, METRIC_COLS, load_multiperiod_data, resolve_parse_mode, PARSE_MODES
+
+
+def generate_csv(n_rows, decimal=',', seed=0):
+    """Genera un CSV multi-periodo sintetico con la struttura attesa dall'app"""
+    rng = np.random.default_rng(seed)
+    types = np.array(['ADV', 'Organic', 'Referral', 'Email'])
+
+    period_row = ['', '']
+    for period_name in PERIODS:
+        period_row += [period_name] + [''] * (len(METRIC_COLS) - 1)
+    header_row = ['tag', 'type'] + METRIC_COLS * len(PERIODS)
+
+    columns = [
+        np.char.add('tag_', np.arange(n_rows).astype(str)),
+        types[rng.integers(0, len(types), n_rows)],
+    ]
+    for _ in PERIODS:
+        leads = rng.integers(0, 2000, n_rows)
+        talked = (leads * rng.uniform(0.3, 0.9, n_rows)).astype(int)
+        booked = (talked * rng.uniform(0.1, 0.6, n_rows)).astype(int)
+        sessions = (booked * rng.uniform(0.5, 0.95, n_rows)).astype(int)
+        sold = (sessions * rng.uniform(0.1, 0.5, n_rows)).astype(int)
+        paid = (sold * rng.uniform(0.7, 1.0, n_rows)).astype(int)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percs = [
+                np.nan_to_num(booked / leads * 100),
+                np.nan_to_num(sold / sessions * 100),
+                np.nan_to_num(paid / leads * 100),
+            ]
+        percs = [np.char.replace(np.round(p, 2).astype(str), '.', decimal) for p in percs]
+        columns += [leads, talked, booked, percs[0], sessions, percs[1], sold, paid, percs[2]]
+
+    lines = [','.join(period_row), ','.join(header_row)]
+    # Le percentuali con la virgola vanno quotate
+    quote = '"' if decimal == ',' else ''
+    for row in zip(*[np.asarray(c).astype(str) for c in columns]):
+        lines.append(','.join(
+            f'{quote}{v}{quote}' if i >= 2 and (i - 2) % len(METRIC_COLS) in (3, 5, 8) else v
+            for i, v in enumerate(row)
+        ))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def time_mode(payload, mode, repeat):
+    """Tempo migliore su `repeat` caricamenti nella modalità data"""
+    # Primo giro a vuoto: avvia il pool, che viene poi riutilizzato dall'app
+    load_multiperiod_data(io.BytesIO(payload), mode=mode)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_multiperiod_data(io.BytesIO(payload), mode=mode)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--decimal', choices=[',', '.'], default=',',
+                        help="separatore decimale delle percentuali (',' forza il parsing in Python)")
+    args = parser.parse_args()
+
+    payload = generate_csv(args.rows, decimal=args.decimal)
+    print(f"Righe: {args.rows:,} | Dimensione: {len(payload) / 1e6:.1f} MB | CPU: {os.cpu_count()}")
+
+    timings = {mode: time_mode(payload, mode, args.repeat) for mode in PARSE_MODES}
+
+    sample = pd.read_csv(io.BytesIO(payload), header=None, skiprows=2, dtype={0: str, 1: str}, nrows=1000)
+    blocks = [sample.iloc[:, 2 + i * len(METRIC_COLS):2 + (i + 1) * len(METRIC_COLS)] for i in PERIODS.values()]
+    auto_choice = resolve_parse_mode('auto', blocks, args.rows)
+
+    print(f"{'Modalità':<14}{'Tempo (s)':>12}{'Speedup':>10}")
+    for mode, elapsed in timings.items():
+        label = f"auto→{auto_choice}" if mode == 'auto' else mode
+        print(f"{label:<14}{elapsed:>12.3f}{timings['serial'] / elapsed:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
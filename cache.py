@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Cache LRU thread-safe a dimensione limitata, con contatori di hit/miss/eviction.
+
+    Oltre al numero di elementi (`maxsize`) si può limitare la memoria: con
+    `max_bytes` e `sizeof(value)` si scartano i meno recenti finché la somma
+    delle dimensioni rientra, e un valore più grande del limite non viene
+    memorizzato.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Valore in cache (aggiornandone la recenza) o `default`"""
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Inserisce un valore, scartando i meno recenti oltre `maxsize` o `max_bytes`"""
+        size = self._sizeof(value) if self._sizeof is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._data.pop(key)
+                self.nbytes -= self._sizes.pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                evicted, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def get_or_build(self, key, builder):
+        """Valore in cache o costruito con `builder()` e memorizzato"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = builder()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,120 @@
+import os
+import sys
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+from cache import LRUCache
+
+FUNNEL_STAGES = ['Lead', 'Prenotate', 'Sessioni', 'Vendite']
+FUNNEL_COLS = ['LEAD_TOCCATO', 'CHIAMATA_PRENOTATA', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA']
+
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return value.nbytes + sum(_nbytes(v) for v in value.flat)
+        return value.nbytes
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return 8 * len(value) + sum(_nbytes(v) for v in value)
+    return 8
+
+
+def figure_nbytes(fig):
+    """Stima della memoria di una figura: dati di tutte le tracce (array, liste, stringhe)"""
+    return sum(_nbytes(trace.to_plotly_json()) for trace in fig.data)
+
+
+# Figure condivise tra sessioni: la chiave include l'hash del dataset. Il
+# limite in MB conta i dati delle tracce, che per un dataset grande pesano
+# decine di MB per figura: il numero di figure da solo non basta
+_figures = LRUCache(
+    int(os.environ.get('ANALISI_FIGURE_CACHE_SIZE', '64')),
+    max_bytes=int(float(os.environ.get('ANALISI_FIGURE_CACHE_MB', '256')) * 1024 ** 2),
+    sizeof=figure_nbytes,
+)
+
+
+def cached_figure(key, builder):
+    """Figura Plotly in cache per `key`, costruita con `builder()` solo se manca.
+
+    La chiave deve contenere l'hash del dataset e tutti i parametri da cui
+    dipende il grafico; le figure in cache non vanno modificate.
+    """
+    return _figures.get_or_build(key, builder)
+
+
+def figure_cache_stats():
+    return _figures.stats()
+
+
+def scatter_figure(df_selected):
+    """Volume vs efficienza delle righe selezionate"""
+    fig = px.scatter(
+        df_selected,
+        x='CHIUSURA_PAY_VALIDA',
+        y='conversion_rate',
+        size='LEAD_TOCCATO',
+        color='type',
+        hover_name='tag',
+        title='Volume vs Efficienza',
+        labels={'CHIUSURA_PAY_VALIDA': 'Vendite', 'conversion_rate': 'Conversion Rate (%)'}
+    )
+    fig.update_layout(height=500)
+    return fig
+
+
+def funnel_figure(funnel_by_type):
+    """Funnel per type: una barra per type, tracce costruite dagli array delle somme"""
+    values = funnel_by_type[FUNNEL_COLS].to_numpy()
+    fig = go.Figure(data=[
+        go.Bar(name=type_name, x=FUNNEL_STAGES, y=stage_values)
+        for type_name, stage_values in zip(funnel_by_type['type'].tolist(), values)
+    ])
+    fig.update_layout(title='Funnel per Type', barmode='group', height=500)
+    return fig
+
+
+def trend_line_figure(trend_df, y, title):
+    """Andamento per periodo dei tag selezionati"""
+    fig = px.line(
+        trend_df,
+        x='Periodo',
+        y=y,
+        color='Tag',
+        markers=True,
+        title=title
+    )
+    fig.update_layout(height=400)
+    return fig
+
+
+def comparison_figure(top_changes, period_previous, period_current):
+    """Vendite dei tag con le maggiori variazioni nei due periodi"""
+    fig = go.Figure(data=[
+        go.Bar(
+            name=period_previous,
+            x=top_changes['tag_short'],
+            y=top_changes['CHIUSURA_PAY_VALIDA_previous'],
+            marker_color='lightblue'
+        ),
+        go.Bar(
+            name=period_current,
+            x=top_changes['tag_short'],
+            y=top_changes['CHIUSURA_PAY_VALIDA_current'],
+            marker_color='darkblue'
+        ),
+    ])
+    fig.update_layout(
+        title='Confronto Vendite tra Periodi (Top 20 variazioni)',
+        barmode='group',
+        height=500,
+        xaxis_tickangle=-45
+    )
+    return fig
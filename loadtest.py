@@ -0,0 +1,253 @@
+"""Load test dell'app con N sessioni simulate concorrenti.
+
+Ogni sessione esegue app.py in modalità headless con l'API AppTest di Streamlit,
+carica un CSV generato e ripete uno script di interazioni (slider, selectbox,
+ricerca). Richiede una versione di Streamlit in cui AppTest supporta
+st.file_uploader.
+
+Due modalità, che misurano cose diverse:
+
+- shared (default): tutte le sessioni in questo processo, come in un unico
+  container Streamlit. Condividono SessionStore, cache dei grafici e pool del
+  parsing, quindi si vedono budget di memoria, spill e ricaricamenti; la RSS
+  riportata è la crescita del processo rispetto all'avvio. AppTest imposta il
+  runtime di Streamlit come stato globale del processo, quindi i rerun sono
+  serializzati da un lock: si riportano separatamente il tempo di servizio di
+  ogni rerun e l'attesa in coda. La contesa sul GIL tra rerun simultanei non
+  viene misurata.
+- processes: una sessione per processo, tutte avviate insieme. Misura N
+  interpreti indipendenti che si contendono solo CPU e memoria della macchina:
+  store, cache e pool del parsing non sono condivisi, e la RSS è quella di N
+  interpreti separati, non la crescita di un server.
+
+Con meno di PARALLEL_MIN_ROWS righe il parsing è seriale: il default di
+--rows è sopra la soglia, così il pool del parsing viene usato.
+
+Uso: python loadtest.py [--mode shared|processes] [--sessions 1 2 4 8] [--rows 25000] [--rounds 2]
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+from analysis import PARALLEL_MIN_ROWS
+from benchmark import generate_csv
+from session_store import get_store
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# Script di interazioni: (nome, tipo widget, etichetta, valore)
+INTERACTIONS = [
+    ('lead_slider', 'slider', "Range minimo LEAD_TOCCATO", 100),
+    ('type_select', 'selectbox', "Filtra per Type", 1),
+    ('weight_slider', 'slider', "Peso Volume", 0.7),
+    ('search', 'text_input', "Cerca tag", "tag_1"),
+    ('period_select', 'selectbox', "Seleziona periodo", 2),
+    ('type_reset', 'selectbox', "Filtra per Type", 0),
+    ('lead_reset', 'slider', "Range minimo LEAD_TOCCATO", 50),
+]
+
+
+def rss_mb():
+    """RSS corrente del processo in MB (picco se /proc non è disponibile)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in byte su macOS, in KB su Linux
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _find_widget(at, kind, label):
+    for widget in getattr(at, kind):
+        if widget.label == label:
+            return widget
+    raise LookupError(f"Widget {kind} '{label}' non trovato")
+
+
+def _timed_run(at, timings, name, lock=None):
+    """Esegue un rerun registrando (servizio, attesa) in secondi"""
+    start = time.perf_counter()
+    if lock is None:
+        served = start
+        at.run()
+    else:
+        with lock:
+            served = time.perf_counter()
+            at.run()
+    end = time.perf_counter()
+    timings.setdefault(name, []).append((end - served, served - start))
+    if at.exception:
+        raise RuntimeError(f"{name}: {at.exception[0].message}")
+
+
+def run_session(payload, rounds, timeout, lock=None):
+    """Una sessione: upload del CSV e `rounds` ripetizioni dello script"""
+    timings = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    _timed_run(at, timings, 'initial', lock)
+
+    at.file_uploader[0].set_value(("export.csv", payload, "text/csv"))
+    _timed_run(at, timings, 'upload', lock)
+
+    for _ in range(rounds):
+        for name, kind, label, value in INTERACTIONS:
+            widget = _find_widget(at, kind, label)
+            if kind == 'selectbox':
+                widget.set_value(widget.options[min(value, len(widget.options) - 1)])
+            else:
+                widget.set_value(value)
+            _timed_run(at, timings, name, lock)
+    return timings
+
+
+def _merge(merged, timings):
+    for name, values in timings.items():
+        merged.setdefault(name, []).extend(values)
+
+
+def run_level_shared(n_sessions, payloads, rounds, timeout):
+    """N sessioni concorrenti in questo processo, sullo store condiviso.
+
+    Restituisce (tempi per interazione, durata in s).
+    """
+    merged = {}
+    errors = []
+    merge_lock = threading.Lock()
+    # Vedi docstring del modulo: AppTest non è thread-safe
+    run_lock = threading.Lock()
+
+    def worker(i):
+        try:
+            timings = run_session(payloads[i % len(payloads)], rounds, timeout, run_lock)
+        except Exception as e:
+            timings = {}
+            errors.append(f"{type(e).__name__}: {e}")
+        with merge_lock:
+            _merge(merged, timings)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return merged, time.perf_counter() - start
+
+
+def _session_process(payload, rounds, timeout, barrier, results):
+    """Processo di una sessione: attende le altre, poi esegue lo script"""
+    barrier.wait()
+    try:
+        results.put((run_session(payload, rounds, timeout), rss_mb(), None))
+    except Exception as e:
+        results.put(({}, rss_mb(), f"{type(e).__name__}: {e}"))
+
+
+def run_level_processes(n_sessions, payloads, rounds, timeout):
+    """N sessioni concorrenti, una per processo.
+
+    Restituisce (tempi per interazione, RSS di ogni processo in MB, durata in s).
+    """
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(n_sessions + 1)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_session_process, args=(payloads[i % len(payloads)], rounds, timeout, barrier, results))
+        for i in range(n_sessions)
+    ]
+    for process in processes:
+        process.start()
+
+    # Il tempo parte quando tutti i processi hanno importato Streamlit
+    barrier.wait()
+    start = time.perf_counter()
+    merged = {}
+    rss = []
+    errors = []
+    try:
+        for _ in processes:
+            timings, process_rss, error = results.get(timeout=timeout * (rounds * len(INTERACTIONS) + 2))
+            _merge(merged, timings)
+            rss.append(process_rss)
+            if error:
+                errors.append(error)
+    except queue.Empty:
+        errors.append("timeout in attesa dei risultati delle sessioni")
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return merged, rss, elapsed
+
+
+def print_timings(names, timings, show_wait):
+    header = f"{'Interazione':<16}{'n':>6}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}"
+    if show_wait:
+        header += f"{'attesa p95':>12}{'totale p95':>12}"
+    print(header)
+    for name in names:
+        values = np.array(timings.get(name, []), dtype=float).reshape(-1, 2) * 1000
+        if values.size == 0:
+            continue
+        p50, p95, p99 = np.percentile(values[:, 0], [50, 95, 99])
+        line = f"{name:<16}{len(values):>6}{p50:>12.1f}{p95:>12.1f}{p99:>12.1f}"
+        if show_wait:
+            line += f"{np.percentile(values[:, 1], 95):>12.1f}{np.percentile(values.sum(axis=1), 95):>12.1f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['shared', 'processes'], default='shared')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--rows', type=int, default=25000)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    # Un CSV diverso per sessione: ogni sessione tiene il proprio dataset
+    payloads = [generate_csv(args.rows, seed=i) for i in range(max(args.sessions))]
+    parsing = "parallelo" if args.rows >= PARALLEL_MIN_ROWS else "seriale"
+    print(f"Righe per CSV: {args.rows:,} (parsing {parsing}) | Dimensione: {len(payloads[0]) / 1e6:.1f} MB")
+
+    names = ['initial', 'upload'] + list(dict.fromkeys(name for name, *_ in INTERACTIONS))
+    baseline_rss = rss_mb()
+    if args.mode == 'shared':
+        print(f"Modalità shared: un processo, rerun serializzati | RSS iniziale {baseline_rss:.0f} MB")
+
+    for n_sessions in args.sessions:
+        if args.mode == 'shared':
+            timings, elapsed = run_level_shared(n_sessions, payloads, args.rounds, args.timeout)
+            store = get_store().stats()
+            print(
+                f"\n=== {n_sessions} sessioni | {elapsed:.1f} s | "
+                f"RSS {rss_mb():.0f} MB (+{rss_mb() - baseline_rss:.0f} MB dall'avvio) | "
+                f"store: {store['resident_bytes'] / 1024 ** 2:.0f} MB residenti, "
+                f"{store['spills']} spill, {store['reloads']} ricaricamenti ==="
+            )
+            print("Servizio = durata del rerun; attesa = coda dietro i rerun delle altre sessioni")
+        else:
+            timings, rss, elapsed = run_level_processes(n_sessions, payloads, args.rounds, args.timeout)
+            print(
+                f"\n=== {n_sessions} sessioni (processi indipendenti) | {elapsed:.1f} s | "
+                f"RSS per processo: min {min(rss):.0f} / mediana {np.median(rss):.0f} / max {max(rss):.0f} MB ==="
+            )
+        print_timings(names, timings, show_wait=args.mode == 'shared')
+
+
+if __name__ == '__main__':
+    main()
@@ -157,6 +157,18 @@ with tab2:
     st.markdown("""
     Analizza come cambiano le performance nel tempo.
 
+    **Classifica Trend:**
+    - Mostra i tag in più rapida crescita e in più rapido calo, calcolati su tutti i tag
+    - **Pendenza**: variazione media al mese (retta ai minimi quadrati)
+    - **Accelerazione**: curvatura del trend, positiva se la crescita sta aumentando
+    - **Volatilità**: quanto oscillano i valori da un periodo all'altro
+    - I periodi hanno durate diverse (110 giorni il più vecchio, poi 90, poi 30):
+      vendite e lead vengono riportati a un ritmo ogni 30 giorni, quindi un tag con
+      vendite giornaliere costanti ha pendenza zero
+    - "Ultimi 90/60/30 GG" si sovrappongono: per la classifica si usano i segmenti
+      disgiunti 90-61, 60-31 e 30-1 giorni, ottenuti per differenza
+    - Usa il filtro sui lead medi per escludere tag con pochi dati
+
     **Come usarla:**
     1. Seleziona fino a 5 tag da confrontare
     2. Visualizza l'andamento di vendite e conversion rate
@@ -243,11 +255,15 @@ with st.expander("Cosa significa 'Session to Sale Rate'?"):
 
 with st.expander("Posso caricare file con formati diversi?"):
     st.markdown("""
-    Attualmente lo strumento supporta solo file CSV con la struttura
-    multi-periodo specifica. Assicurati che il file abbia:
+    Lo strumento supporta file CSV con la struttura multi-periodo specifica.
+    Assicurati che il file abbia:
     - Prima riga: nomi dei periodi
     - Seconda riga: header delle colonne
     - Righe successive: dati
+
+    Per velocizzare l'upload di export grandi puoi caricare il CSV compresso
+    con **gzip** (`.gz`), **zstd** (`.zst`) o in un archivio **zip** con un solo CSV:
+    viene decompresso automaticamente.
     """)
 
 st.markdown("---")
@@ -0,0 +1,290 @@
+"""Servizio HTTP/JSON locale sulle analisi dell'app.
+
+Carica il dataset una sola volta e risponde a query parametrizzate usando le
+stesse funzioni di analysis.py che usa app.py, con una cache LRU dei risultati
+davanti. Il servizio si può interrogare anche senza socket con
+`AnalysisService.handle`, e `make_server(service, port=0)` avvia il server su
+una porta libera per i test in-process.
+
+Endpoint (GET, parametri in query string):
+  /periods
+  /top?period=Ultimi 365 GG&min_leads=50&type=Tutti&weight_volume=0.5&by=composite&n=15
+  /insights?period=Ultimi 365 GG&min_leads=50&type=Tutti&weight_volume=0.5&n=5
+  /compare?current=Ultimi 90 GG&previous=90 precedenti [180-91]&min_leads=20&n=10
+  /metrics
+  /health
+
+Uso: python service.py export.csv [--host 127.0.0.1] [--port 8765] [--cache-size 256]
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from analysis import (
+    PERIODS, load_dataset, compare_periods, build_sort_orders, build_filter_index,
+    select_rows, normalization_maxima, score_period, top_performers, compute_insights,
+    period_movers
+)
+from cache import LRUCache
+
+TOP_KEYS = {
+    'composite': 'composite_score',
+    'volume': 'CHIUSURA_PAY_VALIDA',
+    'efficiency': 'conversion_rate',
+}
+
+TAG_COLUMNS = ['tag', 'type', 'LEAD_TOCCATO', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA',
+               'conversion_rate', 'session_to_sale_rate', 'composite_score']
+
+# Limite sul numero di righe richiedibili con `n`
+MAX_N = 1000
+
+COMPARE_COLUMNS = ['tag', 'type', 'LEAD_TOCCATO_previous', 'LEAD_TOCCATO_current',
+                   'CHIUSURA_PAY_VALIDA_previous', 'CHIUSURA_PAY_VALIDA_current', 'sales_change',
+                   'conversion_rate_previous', 'conversion_rate_current', 'conv_change']
+
+
+class QueryError(ValueError):
+    """Parametri di query non validi (HTTP 400)"""
+
+
+def _param(params, name, default, convert):
+    raw = params.get(name)
+    if raw is None or raw == '':
+        return default
+    try:
+        return convert(raw)
+    except (TypeError, ValueError):
+        raise QueryError(f"Parametro non valido: {name}={raw!r}")
+
+
+def _count(params, default):
+    n = _param(params, 'n', default, int)
+    if not 1 <= n <= MAX_N:
+        raise QueryError(f"n deve essere tra 1 e {MAX_N}")
+    return n
+
+
+def _period(params, name, default):
+    period = params.get(name, default)
+    if period not in PERIODS:
+        raise QueryError(f"Periodo sconosciuto: {period!r}")
+    return period
+
+
+def _records(df, columns):
+    """Righe del DataFrame come lista di dizionari serializzabili in JSON"""
+    return json.loads(df[columns].to_json(orient='records'))
+
+
+class AnalysisService:
+    """Query sulle analisi di un dataset caricato una volta, con cache LRU e metriche"""
+
+    def __init__(self, all_data, cache_size=256, latency_window=1000):
+        self.all_data = all_data
+        self.cache = LRUCache(cache_size)
+        self.started = time.time()
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._latency_window = latency_window
+        self._metrics = {}
+        # endpoint -> (parser dei parametri, calcolo); il risultato è in cache
+        # sotto i parametri normalizzati dal parser
+        self._endpoints = {
+            'periods': (lambda params: (), self._periods),
+            'top': (self._parse_top, self._top),
+            'insights': (self._parse_insights, self._insights),
+            'compare': (self._parse_compare, self._compare),
+        }
+
+    @classmethod
+    def from_file(cls, path, mode='auto', **kwargs):
+        with open(path, 'rb') as f:
+            return cls(load_dataset(f, mode=mode), **kwargs)
+
+    def query(self, endpoint, params=None):
+        """Risultato di una query; solleva QueryError se i parametri non sono validi"""
+        params = params or {}
+        if endpoint == 'metrics':
+            return self.metrics()
+        if endpoint == 'health':
+            return {'status': 'ok'}
+        parser, compute = self._endpoints[endpoint]
+        args = parser(params)
+        return self.cache.get_or_build((endpoint, args), lambda: compute(*args))
+
+    def handle(self, endpoint, params=None):
+        """Esegue una query misurandone la latenza; restituisce (status HTTP, corpo)"""
+        start = time.perf_counter()
+        if endpoint not in self._endpoints and endpoint not in ('metrics', 'health'):
+            status, body = 404, {'error': f"Endpoint sconosciuto: /{endpoint}"}
+            endpoint = 'unknown'
+        else:
+            try:
+                status, body = 200, self.query(endpoint, params)
+            except QueryError as e:
+                status, body = 400, {'error': str(e)}
+            except Exception as e:
+                # Il client riceve sempre una risposta e l'errore finisce nelle metriche
+                status, body = 500, {'error': f"Errore interno: {type(e).__name__}: {e}"}
+        self._record(endpoint, time.perf_counter() - start, status)
+        return status, body
+
+    def metrics(self):
+        """Tempi di risposta per endpoint (ms) e statistiche della cache"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, m in self._metrics.items():
+                latencies = np.array(m['latencies']) * 1000
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (0, 0, 0)
+                endpoints[endpoint] = {
+                    'requests': m['requests'],
+                    'errors': m['errors'],
+                    'p50_ms': round(float(p50), 3),
+                    'p95_ms': round(float(p95), 3),
+                    'p99_ms': round(float(p99), 3),
+                    'max_ms': round(float(latencies.max()), 3) if latencies.size else 0,
+                }
+        return {
+            'uptime_s': round(time.time() - self.started, 1),
+            'cache': self.cache.stats(),
+            'endpoints': endpoints,
+        }
+
+    def _record(self, endpoint, elapsed, status):
+        with self._lock:
+            m = self._metrics.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'latencies': deque(maxlen=self._latency_window),
+            })
+            m['requests'] += 1
+            m['errors'] += status >= 400
+            m['latencies'].append(elapsed)
+
+    # --- Parametri ---
+
+    def _parse_selection(self, params):
+        period = _period(params, 'period', "Ultimi 365 GG")
+        min_leads = _param(params, 'min_leads', 50, int)
+        selected_type = params.get('type') or 'Tutti'
+        weight_volume = _param(params, 'weight_volume', 0.5, float)
+        if not 0 <= weight_volume <= 1:
+            raise QueryError("weight_volume deve essere tra 0 e 1")
+        return period, min_leads, selected_type, weight_volume
+
+    def _parse_top(self, params):
+        by = params.get('by') or 'composite'
+        if by not in TOP_KEYS:
+            raise QueryError(f"Parametro non valido: by={by!r} (ammessi: {', '.join(TOP_KEYS)})")
+        return self._parse_selection(params) + (by, _count(params, 15))
+
+    def _parse_insights(self, params):
+        return self._parse_selection(params) + (_count(params, 5),)
+
+    def _parse_compare(self, params):
+        return (
+            _period(params, 'current', "Ultimi 90 GG"),
+            _period(params, 'previous', "90 precedenti [180-91]"),
+            _param(params, 'min_leads', 20, int),
+            _count(params, 10),
+        )
+
+    # --- Calcoli (stesse funzioni di app.py) ---
+
+    def _prepared(self, period):
+        """Ordinamenti e indice dei filtri del periodo, costruiti alla prima query"""
+        with self._lock:
+            if period not in self._indexes:
+                df = self.all_data[period]
+                self._indexes[period] = (build_sort_orders(df), build_filter_index(df))
+            return self._indexes[period]
+
+    def _scored_selection(self, period, min_leads, selected_type, weight_volume):
+        df = self.all_data[period]
+        orders, filter_index = self._prepared(period)
+        mask = select_rows(df, filter_index, min_leads, None if selected_type == 'Tutti' else selected_type)
+        max_volume, max_efficiency = normalization_maxima(df, orders, mask)
+        composite, composite_order = score_period(df, weight_volume, 1 - weight_volume, max_volume, max_efficiency)
+        return df, composite, {**orders, 'composite_score': composite_order}, mask
+
+    def _periods(self):
+        return {'periods': list(PERIODS)}
+
+    def _top(self, period, min_leads, selected_type, weight_volume, by, n):
+        df, composite, orders, mask = self._scored_selection(period, min_leads, selected_type, weight_volume)
+        top = top_performers(df, composite, orders, mask, TOP_KEYS[by], n)
+        return {'period': period, 'selected': int(mask.sum()), 'rows': _records(top, TAG_COLUMNS)}
+
+    def _insights(self, period, min_leads, selected_type, weight_volume, n):
+        df, composite, orders, mask = self._scored_selection(period, min_leads, selected_type, weight_volume)
+        insights = compute_insights(df, composite, orders, mask, n)
+        return {
+            'period': period,
+            'selected': int(mask.sum()),
+            **{category: _records(rows, TAG_COLUMNS) for category, rows in insights.items()},
+        }
+
+    def _compare(self, current, previous, min_leads, n):
+        comparison = compare_periods(self.all_data[current], self.all_data[previous], min_leads)
+        movers = period_movers(comparison, n)
+        return {
+            'current': current,
+            'previous': previous,
+            'compared': len(comparison),
+            **{category: _records(rows, COMPARE_COLUMNS) for category, rows in movers.items()},
+        }
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        status, body = self.server.service.handle(url.path.strip('/'), params)
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Le metriche sono su /metrics: niente log per richiesta
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=0):
+    """Server HTTP multi-thread sul servizio; port=0 sceglie una porta libera"""
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('csv', help="file CSV multi-periodo da caricare")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=256)
+    args = parser.parse_args()
+
+    service = AnalysisService.from_file(args.csv, cache_size=args.cache_size)
+    server = make_server(service, args.host, args.port)
+    print(f"Servizio in ascolto su http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def frame_nbytes(df):
+    """Memoria occupata da un DataFrame, stringhe comprese"""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def value_nbytes(value):
+    """Memoria occupata da una struttura derivata (array, DataFrame e contenitori)"""
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sum(value_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(v) for v in value)
+    return 0
+
+
+class SessionStore:
+    """Dataset caricati per sessione, con budget di memoria e spill su disco.
+
+    Ogni sessione tiene un solo dataset (dizionario nome -> DataFrame) identificato
+    dall'hash del contenuto. Le sessioni inattive oltre `idle_timeout` secondi, o le
+    meno recenti quando la memoria residente supera `budget_bytes`, vengono scritte
+    in parquet nella `spill_dir` e ricaricate in modo trasparente al prossimo accesso.
+    Le sessioni inattive oltre `ttl` secondi vengono eliminate insieme ai file.
+
+    Le strutture derivate dal dataset (ordinamenti, indici) restano in memoria
+    accanto ai dati e contano nel budget, ma non vengono scritte su disco: allo
+    spill si scartano e si ricostruiscono al primo accesso.
+
+    Il lock è condiviso da tutte le sessioni ma non viene mai tenuto durante
+    parsing, scrittura o lettura dei parquet.
+    """
+
+    def __init__(self, budget_bytes, idle_timeout, ttl, spill_dir):
+        self.budget_bytes = budget_bytes
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._counters = {
+            'loads': 0,
+            'hits': 0,
+            'spills': 0,
+            'reloads': 0,
+            'bytes_spilled': 0,
+            'bytes_reloaded': 0,
+            'expired': 0,
+            'spill_errors': 0,
+        }
+
+    def get(self, session_id, content_hash, loader):
+        """Restituisce il dataset della sessione, caricandolo con `loader()` se cambia file"""
+        now = time.monotonic()
+        with self._lock:
+            pending = self._sweep(now, keep=session_id)
+            entry = self._entries.get(session_id)
+            if entry is not None and entry['hash'] == content_hash:
+                entry['last_access'] = now
+                frames = entry['frames']
+                if frames is not None:
+                    self._counters['hits'] += 1
+            else:
+                entry = None
+        self._run_io(pending)
+
+        if entry is not None:
+            if frames is None:
+                frames = self._reload(session_id, entry)
+            return frames
+
+        # Parsing fuori dal lock: le altre sessioni non devono aspettare
+        frames = loader()
+        nbytes = sum(frame_nbytes(df) for df in frames.values())
+
+        with self._lock:
+            previous = self._entries.get(session_id)
+            pending = self._new_pending()
+            if previous is not None:
+                self._discard_files(previous, pending)
+            self._entries[session_id] = {
+                'hash': content_hash,
+                'frames': frames,
+                'names': list(frames),
+                'nbytes': nbytes,
+                'derived': {},
+                'derived_nbytes': 0,
+                'last_access': time.monotonic(),
+                'path': None,
+                'spilling': False,
+            }
+            self._counters['loads'] += 1
+            self._enforce_budget(keep=session_id, pending=pending)
+        self._run_io(pending)
+        return frames
+
+    def derived(self, session_id, key, builder, version=None):
+        """Struttura derivata dal dataset della sessione, costruita con `builder()`.
+
+        Il valore in cache viene riusato finché `version` non cambia; con una
+        versione diversa viene ricostruito e sostituito.
+        """
+        with self._lock:
+            cached = self._entries[session_id]['derived'].get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        value = builder()
+
+        pending = self._new_pending()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry['frames'] is not None:
+                previous = entry['derived'].get(key)
+                if previous is not None:
+                    entry['derived_nbytes'] -= previous[2]
+                nbytes = value_nbytes(value)
+                entry['derived'][key] = (version, value, nbytes)
+                entry['derived_nbytes'] += nbytes
+                self._enforce_budget(keep=session_id, pending=pending)
+        self._run_io(pending)
+        return value
+
+    def session_bytes(self, session_id):
+        """Byte residenti in memoria per la sessione (0 se assente o su disco)"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry['frames'] is None:
+                return 0
+            return self._resident_nbytes(entry)
+
+    def stats(self):
+        """Metriche aggregate su memoria, spill e ricaricamenti"""
+        with self._lock:
+            resident = [e for e in self._entries.values() if e['frames'] is not None]
+            return {
+                **self._counters,
+                'sessions': len(self._entries),
+                'resident_sessions': len(resident),
+                'spilled_sessions': len(self._entries) - len(resident),
+                'resident_bytes': sum(self._resident_nbytes(e) for e in resident),
+                'budget_bytes': self.budget_bytes,
+            }
+
+    # Il lock protegge solo lo stato in memoria: sotto lock si scelgono le
+    # sessioni da scaricare e i file da eliminare (`pending`), la lettura e la
+    # scrittura su disco avvengono dopo averlo rilasciato, in `_run_io`.
+
+    @staticmethod
+    def _new_pending():
+        return {'spill': [], 'remove': []}
+
+    def _sweep(self, now, keep):
+        """Sceglie le sessioni inattive da scaricare ed elimina quelle scadute"""
+        pending = self._new_pending()
+        for session_id, entry in list(self._entries.items()):
+            if session_id == keep:
+                continue
+            idle = now - entry['last_access']
+            if idle > self.ttl:
+                self._discard_files(entry, pending)
+                del self._entries[session_id]
+                self._counters['expired'] += 1
+            elif idle > self.idle_timeout and entry['frames'] is not None and not entry['spilling']:
+                self._mark_spill(session_id, entry, pending)
+        return pending
+
+    def _enforce_budget(self, keep, pending):
+        """Sceglie le sessioni meno recenti da scaricare finché la memoria rientra nel budget"""
+        # Le sessioni già in scrittura libereranno la loro memoria: non contano
+        resident = [
+            (e['last_access'], session_id)
+            for session_id, e in self._entries.items()
+            if e['frames'] is not None and not e['spilling']
+        ]
+        total = sum(self._resident_nbytes(self._entries[session_id]) for _, session_id in resident)
+        for _, session_id in sorted(resident):
+            if total <= self.budget_bytes:
+                break
+            if session_id == keep:
+                continue
+            entry = self._entries[session_id]
+            total -= self._resident_nbytes(entry)
+            self._mark_spill(session_id, entry, pending)
+
+    def _mark_spill(self, session_id, entry, pending):
+        entry['spilling'] = True
+        pending['spill'].append((session_id, entry, entry['frames'], entry['last_access']))
+
+    def _discard_files(self, entry, pending):
+        if entry['path'] is not None:
+            pending['remove'].append(entry['path'])
+            entry['path'] = None
+
+    def _run_io(self, pending):
+        """Esegue fuori dal lock gli spill e le eliminazioni scelti sotto lock"""
+        for path in pending['remove']:
+            shutil.rmtree(path, ignore_errors=True)
+        for victim in pending['spill']:
+            self._spill(*victim)
+
+    def _spill(self, session_id, entry, frames, picked_access):
+        """Scrive il dataset in parquet e libera la memoria.
+
+        Gira nel rerun di un'altra sessione: un errore di scrittura non si
+        propaga, la sessione resta in memoria e torna candidata allo spill.
+        """
+        # Un dataset già ricaricato da disco ha ancora i suoi file: basta liberarlo
+        path = entry['path']
+        if path is None:
+            path = os.path.join(self.spill_dir, f"{session_id}-{entry['hash']}")
+            try:
+                os.makedirs(path, exist_ok=True)
+                for i, name in enumerate(entry['names']):
+                    frames[name].to_parquet(os.path.join(path, f'{i}.parquet'))
+            except Exception:
+                shutil.rmtree(path, ignore_errors=True)
+                with self._lock:
+                    entry['spilling'] = False
+                    self._counters['spill_errors'] += 1
+                return
+
+        with self._lock:
+            entry['spilling'] = False
+            if self._entries.get(session_id) is not entry:
+                # Sessione eliminata o sostituita durante la scrittura
+                orphan = path
+            else:
+                orphan = None
+                entry['path'] = path
+                # Se la sessione è stata usata nel frattempo resta in memoria
+                if entry['last_access'] == picked_access:
+                    entry['frames'] = None
+                    entry['derived'] = {}
+                    entry['derived_nbytes'] = 0
+                    self._counters['spills'] += 1
+                    self._counters['bytes_spilled'] += entry['nbytes']
+        if orphan is not None:
+            shutil.rmtree(orphan, ignore_errors=True)
+
+    def _reload(self, session_id, entry):
+        """Rilegge da disco un dataset scaricato in precedenza"""
+        frames = {
+            name: pd.read_parquet(os.path.join(entry['path'], f'{i}.parquet'))
+            for i, name in enumerate(entry['names'])
+        }
+        pending = self._new_pending()
+        with self._lock:
+            # Un rerun concorrente della stessa sessione può averlo già ricaricato
+            if entry['frames'] is not None:
+                return entry['frames']
+            entry['frames'] = frames
+            self._counters['reloads'] += 1
+            self._counters['bytes_reloaded'] += entry['nbytes']
+            self._enforce_budget(keep=session_id, pending=pending)
+        self._run_io(pending)
+        return frames
+
+    def _resident_nbytes(self, entry):
+        return entry['nbytes'] + entry['derived_nbytes']
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Store condiviso dal processo, configurato da variabili d'ambiente"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(
+                budget_bytes=int(float(os.environ.get('ANALISI_MEMORY_BUDGET_MB', '1024')) * 1024 ** 2),
+                idle_timeout=float(os.environ.get('ANALISI_SESSION_IDLE_S', '600')),
+                ttl=float(os.environ.get('ANALISI_SESSION_TTL_S', '86400')),
+                spill_dir=os.environ.get('ANALISI_SPILL_DIR') or tempfile.mkdtemp(prefix='analisi_spill_'),
+            )
+        return _store
@@ -0,0 +1,21 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import load_dataset  # noqa: E402
+from benchmark import generate_csv  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def csv_payload():
+    """CSV multi-periodo sintetico, piccolo ma con tutti i periodi"""
+    return generate_csv(300, seed=1)
+
+
+@pytest.fixture(scope='session')
+def all_data(csv_payload):
+    return load_dataset(io.BytesIO(csv_payload), mode='serial')
@@ -0,0 +1,194 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import (
+    _get_executor, load_multiperiod_data, period_movers, build_sort_orders, build_filter_index,
+    select_rows, aggregate_by_type, normalization_maxima, score_period, top_performers, compute_insights,
+    ORDERED_PERIODS, PERIOD_DAYS, TREND_RATE_DAYS, build_trend_cube, trend_statistics, rank_trends
+)
+from benchmark import generate_csv
+
+
+def _baseline_scored(df, lead_min, selected_type, weight_volume):
+    """Filtro e score composito come nella versione originale di app.py"""
+    df_filtered = df[df['LEAD_TOCCATO'] >= lead_min].copy()
+    if selected_type is not None:
+        df_filtered = df_filtered[df_filtered['type'] == selected_type]
+    max_volume = df_filtered['CHIUSURA_PAY_VALIDA'].max()
+    max_efficiency = df_filtered['conversion_rate'].max()
+    df_filtered['composite_score'] = (
+        np.where(max_volume > 0, df_filtered['CHIUSURA_PAY_VALIDA'] / max_volume * 100, 0) * weight_volume +
+        np.where(max_efficiency > 0, df_filtered['conversion_rate'] / max_efficiency * 100, 0) * (1 - weight_volume)
+    )
+    return df_filtered
+
+
+@pytest.mark.parametrize('period', ['Ultimi 365 GG', 'Ultimi 30 GG'])
+@pytest.mark.parametrize('lead_min', [0, 200, 1500])
+@pytest.mark.parametrize('selected_type', [None, 'ADV'])
+@pytest.mark.parametrize('weight_volume', [0.0, 0.3, 1.0])
+def test_rankings_and_insights_match_baseline(all_data, period, lead_min, selected_type, weight_volume):
+    df = all_data[period]
+    orders = build_sort_orders(df)
+    mask = select_rows(df, build_filter_index(df), lead_min, selected_type)
+    composite, composite_order = score_period(df, weight_volume, 1 - weight_volume, *normalization_maxima(df, orders, mask))
+    ranking_orders = {**orders, 'composite_score': composite_order}
+    expected = _baseline_scored(df, lead_min, selected_type, weight_volume)
+    columns = list(expected.columns)
+
+    for key in ('composite_score', 'CHIUSURA_PAY_VALIDA', 'conversion_rate'):
+        pd.testing.assert_frame_equal(
+            top_performers(df, composite, ranking_orders, mask, key, 15)[columns],
+            expected.nlargest(15, key)
+        )
+
+    median_conv = expected['conversion_rate'].median()
+    median_leads = expected['LEAD_TOCCATO'].median()
+    baseline = {
+        'best_balanced': expected[expected['CHIUSURA_PAY_VALIDA'] >= 3].nlargest(5, 'composite_score'),
+        'opportunities': expected[
+            (expected['conversion_rate'] > median_conv) &
+            (expected['LEAD_TOCCATO'] < median_leads) &
+            (expected['CHIUSURA_PAY_VALIDA'] > 0)
+        ].nlargest(5, 'conversion_rate'),
+        'to_optimize': expected[
+            (expected['conversion_rate'] < median_conv) &
+            (expected['LEAD_TOCCATO'] > median_leads)
+        ].nlargest(5, 'LEAD_TOCCATO'),
+    }
+    insights = compute_insights(df, composite, ranking_orders, mask)
+    assert list(insights) == list(baseline)
+    for category, rows in baseline.items():
+        pd.testing.assert_frame_equal(insights[category][columns], rows)
+
+
+@pytest.mark.parametrize('decimal', [',', '.'])
+def test_parse_modes_produce_identical_frames(decimal):
+    payload = generate_csv(500, decimal=decimal, seed=4)
+    serial = load_multiperiod_data(io.BytesIO(payload), mode='serial')
+    for mode in ('thread', 'process'):
+        parsed = load_multiperiod_data(io.BytesIO(payload), mode=mode, max_workers=2)
+        assert list(parsed) == list(serial)
+        for period, df in serial.items():
+            pd.testing.assert_frame_equal(parsed[period], df)
+
+
+def test_broken_process_pool_is_rebuilt(csv_payload):
+    expected = load_multiperiod_data(io.BytesIO(csv_payload), mode='serial')
+    executor = _get_executor('process', 2)
+    # Un worker che muore rende il pool inutilizzabile
+    with pytest.raises(Exception):
+        executor.submit(os._exit, 1).result()
+
+    parsed = load_multiperiod_data(io.BytesIO(csv_payload), mode='process', max_workers=2)
+    assert _get_executor('process', 2) is not executor
+    for period, df in expected.items():
+        pd.testing.assert_frame_equal(parsed[period], df)
+
+
+@pytest.fixture
+def comparison():
+    return pd.DataFrame({
+        'tag': list('abcdefg'),
+        'sales_change': [3.0, -2.0, 3.0, 0.0, -2.0, 5.0, -7.0],
+    })
+
+
+@pytest.mark.parametrize('n', [-2, 0, 1, 2, 3, 10])
+def test_period_movers_matches_nlargest_nsmallest(comparison, n):
+    movers = period_movers(comparison, n)
+    change = comparison['sales_change']
+    pd.testing.assert_frame_equal(movers['growing'], comparison[change > 0].nlargest(n, 'sales_change'))
+    pd.testing.assert_frame_equal(movers['declining'], comparison[change < 0].nsmallest(n, 'sales_change'))
+
+
+@pytest.fixture
+def typed_period(all_data):
+    df = all_data['Ultimi 90 GG'].copy()
+    # Un type mancante: groupby lo esclude, la maschera per type non lo seleziona
+    df.loc[df.index[::7], 'type'] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('lead_min', [0, 1, 500, 1999, 5000])
+@pytest.mark.parametrize('selected_type', [None, 'ADV', 'Email', 'Sconosciuto'])
+def test_select_rows_matches_pandas_filter(typed_period, lead_min, selected_type):
+    df = typed_period
+    expected = df['LEAD_TOCCATO'] >= lead_min
+    if selected_type is not None:
+        expected &= df['type'] == selected_type
+    mask = select_rows(df, build_filter_index(df), lead_min, selected_type)
+    np.testing.assert_array_equal(mask, expected.to_numpy())
+
+
+@pytest.mark.parametrize('lead_min', [0, 500, 5000])
+@pytest.mark.parametrize('selected_type', [None, 'Referral'])
+def test_aggregate_by_type_matches_groupby(typed_period, lead_min, selected_type):
+    df = typed_period
+    index = build_filter_index(df)
+    mask = select_rows(df, index, lead_min, selected_type)
+    columns = ['LEAD_TOCCATO', 'CHIAMATA_PRENOTATA', 'SESSIONE_SVOLTA', 'CHIUSURA_PAY_VALIDA']
+    expected = df[mask].groupby('type')[columns].sum().reset_index()
+    pd.testing.assert_frame_equal(aggregate_by_type(df, index, mask, columns), expected, check_dtype=False)
+    assert list(aggregate_by_type(df, index, mask, columns).dtypes[1:]) == list(df[columns].dtypes)
+
+
+def _trend_data(daily_sales, daily_leads):
+    """Periodi cronologici da vendite e lead giornalieri per tag: f(giorni fa) -> valore"""
+    all_data = {}
+    for period in ORDERED_PERIODS:
+        first, last = PERIOD_DAYS[period]
+        days = np.arange(last, first + 1)
+        all_data[period] = pd.DataFrame({
+            'tag': list(daily_sales),
+            'CHIUSURA_PAY_VALIDA': [f(days).sum() for f in daily_sales.values()],
+            'LEAD_TOCCATO': [daily_leads[tag](days).sum() for tag in daily_sales],
+        })
+    return all_data
+
+
+def test_constant_daily_rate_has_no_trend():
+    all_data = _trend_data(
+        {'small': lambda d: np.full(len(d), 1.0), 'large': lambda d: np.full(len(d), 40.0)},
+        {'small': lambda d: np.full(len(d), 10.0), 'large': lambda d: np.full(len(d), 200.0)},
+    )
+    stats = trend_statistics(build_trend_cube(all_data))
+    for name in ('slope', 'acceleration', 'volatility'):
+        np.testing.assert_allclose(stats[name], 0, atol=1e-9)
+
+
+def test_linear_daily_rate_slope_per_month():
+    # Vendite giornaliere che crescono di 0.5 al giorno verso oggi, lead costanti
+    all_data = _trend_data({'tag': lambda d: 600 - 0.5 * d}, {'tag': lambda d: np.full(len(d), 2000.0)})
+    stats = trend_statistics(build_trend_cube(all_data))
+    # Ritmo su TREND_RATE_DAYS giorni, variazione al mese di TREND_RATE_DAYS giorni
+    assert stats['slope'][0, 0] == pytest.approx(0.5 * TREND_RATE_DAYS * TREND_RATE_DAYS)
+    assert stats['slope'][0, 1] == pytest.approx(0, abs=1e-9)
+    assert stats['acceleration'][0, 0] == pytest.approx(0, abs=1e-9)
+    assert stats['volatility'][0, 0] == pytest.approx(0, abs=1e-9)
+
+
+def test_rank_trends():
+    slopes = {'up_fast': 0.3, 'up_slow': 0.1, 'up_tiny_leads': 0.5, 'flat': 0.0, 'down': -0.2, 'down_fast': -0.4}
+    all_data = _trend_data(
+        {tag: (lambda d, b=b: 200 - b * d) for tag, b in slopes.items()},
+        {tag: (lambda d, n=(1.0 if tag == 'up_tiny_leads' else 50.0): np.full(len(d), n)) for tag in slopes},
+    )
+    trend = build_trend_cube(all_data)
+    stats = trend_statistics(trend)
+
+    rising, falling = rank_trends(trend, stats, 'CHIUSURA_PAY_VALIDA', n=10)
+    assert list(rising['tag']) == ['up_tiny_leads', 'up_fast', 'up_slow']
+    assert list(falling['tag']) == ['down_fast', 'down']
+    assert (rising['slope'] > 0).all() and (falling['slope'] < 0).all()
+
+    rising, _ = rank_trends(trend, stats, 'CHIUSURA_PAY_VALIDA', n=10, min_avg_leads=100)
+    assert 'up_tiny_leads' not in set(rising['tag'])
+    assert list(rising['tag']) == ['up_fast', 'up_slow']
+
+    rising, falling = rank_trends(trend, stats, 'CHIUSURA_PAY_VALIDA', n=1)
+    assert list(rising['tag']) == ['up_tiny_leads'] and list(falling['tag']) == ['down_fast']
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+import charts
+from analysis import build_filter_index, select_rows, aggregate_by_type
+from cache import LRUCache
+from charts import FUNNEL_COLS, FUNNEL_STAGES, funnel_figure, figure_nbytes, scatter_figure
+
+
+def test_funnel_matches_iterrows_traces(all_data):
+    df = all_data['Ultimi 365 GG']
+    index = build_filter_index(df)
+    funnel_by_type = aggregate_by_type(df, index, select_rows(df, index, 100), FUNNEL_COLS)
+
+    # Costruzione originale, una traccia per riga con add_trace
+    expected = go.Figure()
+    for _, row in funnel_by_type.iterrows():
+        expected.add_trace(go.Bar(
+            name=row['type'],
+            x=FUNNEL_STAGES,
+            y=[row['LEAD_TOCCATO'], row['CHIAMATA_PRENOTATA'],
+               row['SESSIONE_SVOLTA'], row['CHIUSURA_PAY_VALIDA']],
+        ))
+
+    fig = funnel_figure(funnel_by_type)
+    assert len(fig.data) == len(expected.data)
+    for trace, expected_trace in zip(fig.data, expected.data):
+        assert trace.name == expected_trace.name
+        assert list(trace.x) == list(expected_trace.x)
+        np.testing.assert_array_equal(np.asarray(trace.y, dtype=float), np.asarray(expected_trace.y, dtype=float))
+    assert fig.layout.barmode == 'group'
+
+
+def test_figure_nbytes_grows_with_rows(all_data):
+    df = all_data['Ultimi 365 GG']
+    small = figure_nbytes(scatter_figure(df.head(10)))
+    large = figure_nbytes(scatter_figure(df))
+    # Almeno x, y e size in float64 per ogni riga
+    assert large >= 3 * 8 * len(df)
+    assert large > 5 * small
+
+
+def test_lru_cache_byte_limit():
+    cache = LRUCache(maxsize=10, max_bytes=100, sizeof=len)
+    cache.put('a', 'x' * 40)
+    cache.put('b', 'x' * 40)
+    cache.get('a')
+    cache.put('c', 'x' * 40)
+    # Oltre 100 byte: esce la meno recente, 'b'
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['nbytes'] == 80
+
+    # Un valore più grande del limite non entra e non svuota la cache
+    cache.put('d', 'x' * 500)
+    assert cache.get('d') is None
+    assert cache.stats()['nbytes'] == 80 and cache.stats()['size'] == 2
+
+    cache.put('a', 'x' * 10)
+    assert cache.stats()['nbytes'] == 50
+
+
+def _app_test(payload):
+    testing = pytest.importorskip('streamlit.testing.v1')
+    app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+    at = testing.AppTest.from_file(app_path, default_timeout=120)
+    at.run()
+    at.file_uploader[0].set_value(("export.csv", payload, "text/csv"))
+    at.run()
+    assert not at.exception
+    return at
+
+
+def _widget(at, kind, label):
+    return next(w for w in getattr(at, kind) if w.label == label)
+
+
+def test_figure_keys_follow_view_parameters(csv_payload):
+    charts._figures.clear()
+    at = _app_test(csv_payload)
+
+    def rerun_misses(kind, label, value):
+        before = charts.figure_cache_stats()['misses']
+        _widget(at, kind, label).set_value(value)
+        at.run()
+        assert not at.exception
+        return charts.figure_cache_stats()['misses'] - before
+
+    # I pesi non entrano nella chiave di scatter e funnel: nessuna figura nuova
+    assert rerun_misses('slider', "Peso Volume", 0.8) == 0
+    # Lead minimo e type sì: scatter e funnel si ricostruiscono
+    assert rerun_misses('slider', "Range minimo LEAD_TOCCATO", 100) == 2
+    assert rerun_misses('selectbox', "Filtra per Type", 'ADV') == 2
+    # Tornando a una vista già vista le figure escono dalla cache
+    assert rerun_misses('selectbox', "Filtra per Type", 'Tutti') == 0
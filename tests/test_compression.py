@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+import analysis
+from analysis import content_hash, load_dataset
+from benchmark import generate_csv
+
+zstandard = pytest.importorskip('zstandard')
+
+
+def _zip(payload):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('export.csv', payload)
+    return buffer.getvalue()
+
+
+COMPRESSORS = {
+    'gzip': gzip.compress,
+    'zstd': lambda payload: zstandard.ZstdCompressor().compress(payload),
+    'zip': _zip,
+}
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+def test_compressed_matches_plain_csv(csv_payload, all_data, compression):
+    compressed = io.BytesIO(COMPRESSORS[compression](csv_payload))
+    digest = content_hash(compressed)
+    assert digest == content_hash(io.BytesIO(csv_payload)) == hashlib.sha256(csv_payload).hexdigest()
+    # Il file torna all'inizio, pronto per il parsing
+    data = load_dataset(compressed, mode='serial')
+    for period, df in all_data.items():
+        pd.testing.assert_frame_equal(data[period], df)
+
+
+def test_known_archive_is_not_decompressed_again(csv_payload, monkeypatch):
+    compressed = io.BytesIO(gzip.compress(csv_payload, mtime=0))
+    digest = content_hash(compressed)
+
+    def fail(file):
+        raise AssertionError("archivio già visto: niente decompressione")
+
+    monkeypatch.setattr(analysis, 'open_csv_stream', fail)
+    assert content_hash(compressed) == digest
+
+
+@pytest.mark.parametrize('compression', COMPRESSORS)
+def test_truncated_upload_is_rejected(compression):
+    # Più blocchi compressi: a metà file ci sono già righe complete da leggere
+    compressed = COMPRESSORS[compression](generate_csv(3000, seed=2))
+    truncated = io.BytesIO(compressed[:len(compressed) // 2])
+    with pytest.raises(ValueError):
+        content_hash(truncated)
+    truncated.seek(0)
+    with pytest.raises(ValueError):
+        load_dataset(truncated, mode='serial')
+
+
+def test_multi_frame_zstd(csv_payload, all_data):
+    half = len(csv_payload) // 2
+    compressor = zstandard.ZstdCompressor()
+    payload = compressor.compress(csv_payload[:half]) + compressor.compress(csv_payload[half:])
+    data = load_dataset(io.BytesIO(payload), mode='serial')
+    for period, df in all_data.items():
+        pd.testing.assert_frame_equal(data[period], df)
@@ -0,0 +1,105 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from service import AnalysisService, MAX_N, make_server
+
+
+@pytest.fixture
+def service(all_data):
+    return AnalysisService(all_data, cache_size=2)
+
+
+def test_handle_ok(service):
+    status, body = service.handle('top', {'period': 'Ultimi 90 GG', 'min_leads': '0', 'n': '5'})
+    assert status == 200
+    assert body['period'] == 'Ultimi 90 GG'
+    assert len(body['rows']) == 5
+    scores = [row['composite_score'] for row in body['rows']]
+    assert scores == sorted(scores, reverse=True)
+
+
+@pytest.mark.parametrize('endpoint, params', [
+    ('top', {'period': 'nope'}),
+    ('top', {'by': 'nope'}),
+    ('top', {'weight_volume': '2'}),
+    ('insights', {'n': 'a'}),
+    ('insights', {'n': '0'}),
+    ('compare', {'n': '-2'}),
+    ('compare', {'n': str(MAX_N + 1)}),
+])
+def test_handle_bad_params(service, endpoint, params):
+    status, body = service.handle(endpoint, params)
+    assert status == 400
+    assert 'error' in body
+
+
+def test_handle_unknown_endpoint(service):
+    status, body = service.handle('nope')
+    assert status == 404
+    assert service.metrics()['endpoints']['unknown']['errors'] == 1
+
+
+def test_handle_internal_error(service, monkeypatch):
+    def boom(*args):
+        raise RuntimeError("guasto")
+
+    monkeypatch.setitem(service._endpoints, 'periods', (lambda params: (), boom))
+    status, body = service.handle('periods')
+    assert status == 500
+    assert 'guasto' in body['error']
+    assert service.metrics()['endpoints']['periods']['errors'] == 1
+
+
+def test_cache_hits_and_lru_eviction(service):
+    params = {'current': 'Ultimi 30 GG', 'previous': 'Ultimi 60 GG', 'n': '3'}
+    first = service.handle('compare', params)
+    assert service.handle('compare', params) == first
+    assert service.cache.stats()['hits'] == 1
+
+    # Con maxsize=2 una terza query diversa scarta la meno recente
+    service.handle('compare', {**params, 'n': '4'})
+    service.handle('compare', {**params, 'n': '5'})
+    assert service.cache.stats()['evictions'] == 1
+    service.handle('compare', params)
+    assert service.cache.stats()['misses'] == 4
+
+
+def test_compare_movers_respect_n(service):
+    status, body = service.handle('compare', {'min_leads': '0', 'n': '3'})
+    assert status == 200
+    assert len(body['growing']) <= 3 and len(body['declining']) <= 3
+    assert all(row['sales_change'] > 0 for row in body['growing'])
+    assert all(row['sales_change'] < 0 for row in body['declining'])
+
+
+def _get(port, path):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_http_server(service):
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = server.server_port
+        status, body = _get(port, '/periods')
+        assert status == 200 and 'Ultimi 90 GG' in body['periods']
+        assert _get(port, '/insights?n=0')[0] == 400
+        assert _get(port, '/nope')[0] == 404
+        assert _get(port, '/periods')[0] == 200
+
+        status, metrics = _get(port, '/metrics')
+        assert status == 200
+        assert metrics['cache']['hits'] == 1
+        assert metrics['endpoints']['periods']['requests'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
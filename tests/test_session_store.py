@@ -0,0 +1,134 @@
+import os
+import types
+
+import pandas as pd
+import pytest
+
+import session_store
+from session_store import SessionStore, frame_nbytes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(session_store, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _dataset(seed):
+    return {
+        'Ultimi 30 GG': pd.DataFrame({'tag': [f'tag_{seed}_{i}' for i in range(200)], 'LEAD_TOCCATO': range(200)}),
+        'Ultimi 60 GG': pd.DataFrame({'tag': [f'tag_{seed}_{i}' for i in range(200)], 'LEAD_TOCCATO': range(200)}),
+    }
+
+
+def _dataset_nbytes(data):
+    return sum(frame_nbytes(df) for df in data.values())
+
+
+def _store(tmp_path, budget_bytes=10 ** 9, idle_timeout=60, ttl=3600):
+    return SessionStore(budget_bytes, idle_timeout, ttl, str(tmp_path))
+
+
+def _load(store, session_id, content_hash, data):
+    return store.get(session_id, content_hash, lambda: data)
+
+
+def test_idle_spill_and_reload(tmp_path, clock):
+    store = _store(tmp_path)
+    a = _dataset(1)
+    _load(store, 'a', 'ha', a)
+
+    clock.now += 120
+    _load(store, 'b', 'hb', _dataset(2))
+    stats = store.stats()
+    assert stats['spills'] == 1 and stats['spilled_sessions'] == 1
+    assert store.session_bytes('a') == 0
+
+    def fail():
+        raise AssertionError("il dataset su disco non va riparsato")
+
+    reloaded = store.get('a', 'ha', fail)
+    assert store.stats()['reloads'] == 1
+    assert list(reloaded) == list(a)
+    for name, df in a.items():
+        pd.testing.assert_frame_equal(reloaded[name], df)
+
+
+def test_lru_spill_over_budget(tmp_path, clock):
+    nbytes = _dataset_nbytes(_dataset(1))
+    store = _store(tmp_path, budget_bytes=int(nbytes * 3.5))
+    for i, session_id in enumerate('abc'):
+        clock.now += 1
+        _load(store, session_id, f'h{session_id}', _dataset(i))
+    assert store.stats()['spills'] == 0
+
+    # Sessione 'a' usata di recente: la meno recente diventa 'b'
+    clock.now += 1
+    store.get('a', 'ha', None)
+    clock.now += 1
+    _load(store, 'd', 'hd', _dataset(4))
+
+    assert store.session_bytes('b') == 0
+    assert all(store.session_bytes(s) > 0 for s in 'acd')
+    assert store.stats()['resident_bytes'] <= store.budget_bytes
+
+
+def test_ttl_expiry_removes_files(tmp_path, clock):
+    store = _store(tmp_path, idle_timeout=60, ttl=600)
+    _load(store, 'a', 'ha', _dataset(1))
+    clock.now += 120
+    _load(store, 'b', 'hb', _dataset(2))
+    assert os.listdir(tmp_path) == ['a-ha']
+
+    clock.now += 1000
+    _load(store, 'c', 'hc', _dataset(3))
+    assert store.stats()['expired'] == 2
+    assert os.listdir(tmp_path) == []
+    with pytest.raises(KeyError):
+        store.derived('a', 'key', lambda: 1)
+
+
+def test_entry_replaced_during_spill_leaves_no_files(tmp_path, clock):
+    store = _store(tmp_path)
+    _load(store, 'a', 'ha', _dataset(1))
+
+    # Spill scelto sotto lock, poi la sessione carica un altro file prima della scrittura
+    pending = store._new_pending()
+    with store._lock:
+        store._mark_spill('a', store._entries['a'], pending)
+    replacement = _dataset(2)
+    _load(store, 'a', 'ha2', replacement)
+    store._run_io(pending)
+
+    assert os.listdir(tmp_path) == []
+    assert store.get('a', 'ha2', None) is replacement
+    assert store.stats()['spills'] == 0
+
+
+def test_spill_error_keeps_session_resident(tmp_path, clock):
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_text('')
+    store = _store(not_a_dir)
+    _load(store, 'a', 'ha', _dataset(1))
+
+    clock.now += 120
+    # Lo spill di 'a' fallisce nel rerun di 'b', che non deve vedere l'errore
+    _load(store, 'b', 'hb', _dataset(2))
+    stats = store.stats()
+    assert stats['spill_errors'] == 1 and stats['spills'] == 0
+    assert store.session_bytes('a') > 0
+    assert not store._entries['a']['spilling']
+
+    # 'a' resta candidata: al giro successivo si riprova
+    clock.now += 120
+    _load(store, 'c', 'hc', _dataset(3))
+    assert store.stats()['spill_errors'] == 3